@@ -4,9 +4,114 @@ Handles loading, displaying, and switching between battlemaps.
 """
 
 import os
+import time
+import atexit
+import threading
 import pygame
-import json
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from ..utils.image import load_image, scale_image_to_fit, get_image_files
+from ..utils import serialization
+
+# Recently displayed maps, already scaled to the screen:
+# (path, mtime, screen width, screen height) -> (surface, position, converted).
+# Prefetched maps are stored unconverted and converted to the display format
+# on the main thread when first shown
+_MAP_CACHE = OrderedDict()
+_MAP_CACHE_SIZE = 8
+_MAP_CACHE_LOCK = threading.Lock()  # Shared with the prefetch thread
+
+# Image formats without an alpha channel, which can be blitted opaque
+OPAQUE_FORMATS = ('.jpg', '.jpeg', '.bmp')
+
+# Minimum seconds between background annotation saves
+ANNOTATION_FLUSH_INTERVAL = 5.0
+
+def _new_stroke(color, size, points):
+    """Create an annotation stroke backed by a growable (N, 2) point array."""
+    pts = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+    return {'color': color, 'size': size, 'pts': pts, 'count': len(pts)}
+
+def _append_point(stroke, point):
+    """Append a point to a stroke, doubling its buffer when full."""
+    pts = stroke['pts']
+    count = stroke['count']
+    if count == len(pts):
+        grown = np.empty((max(2 * count, 16), 2), dtype=np.int32)
+        grown[:count] = pts[:count]
+        stroke['pts'] = pts = grown
+    pts[count] = point
+    stroke['count'] = count + 1
+
+def _centered(surface, width, height):
+    """Get the position that centers a surface on a screen of the given size."""
+    map_rect = surface.get_rect()
+    return ((width - map_rect.width) // 2, (height - map_rect.height) // 2)
+
+def _cache_map(key, entry):
+    """Store a cache entry, evicting the least recently used one if full."""
+    with _MAP_CACHE_LOCK:
+        _MAP_CACHE[key] = entry
+        _MAP_CACHE.move_to_end(key)
+        if len(_MAP_CACHE) > _MAP_CACHE_SIZE:
+            _MAP_CACHE.popitem(last=False)
+
+def _load_scaled_map(map_path, width, height):
+    """Load a map scaled to fit the screen, returning (surface, position). Main thread only."""
+    key = (map_path, os.path.getmtime(map_path), width, height)
+    with _MAP_CACHE_LOCK:
+        cached = _MAP_CACHE.get(key)
+        if cached:
+            _MAP_CACHE.move_to_end(key)
+            
+    if cached:
+        scaled, position, converted = cached
+        if converted:
+            return scaled, position
+    else:
+        # Load the map image
+        surface = load_image(map_path)
+        if not surface:
+            return None
+            
+        # Scale the map to fit the screen if needed
+        scaled = scale_image_to_fit(surface, width, height)
+        position = _centered(scaled, width, height)
+    
+    # Match the display format so per-frame blits need no conversion;
+    # opaque maps also skip per-pixel alpha blending entirely
+    if map_path.lower().endswith(OPAQUE_FORMATS):
+        scaled = scaled.convert()
+    else:
+        scaled = scaled.convert_alpha()
+        
+    _cache_map(key, (scaled, position, True))
+    return scaled, position
+
+def _prefetch_scaled_map(map_path, width, height):
+    """Decode and scale a map into the cache without touching the display."""
+    key = (map_path, os.path.getmtime(map_path), width, height)
+    with _MAP_CACHE_LOCK:
+        if key in _MAP_CACHE:
+            return
+            
+    surface = pygame.image.load(map_path)
+    if surface.get_bitsize() < 24:
+        # smoothscale needs 24 or 32-bit pixels; blitting doesn't need a display
+        full_color = pygame.Surface(surface.get_size(), pygame.SRCALPHA, 32)
+        full_color.blit(surface, (0, 0))
+        surface = full_color
+    scaled = scale_image_to_fit(surface, width, height)
+    
+    with _MAP_CACHE_LOCK:
+        if key in _MAP_CACHE:
+            return  # Shown on the main thread in the meantime
+    _cache_map(key, (scaled, _centered(scaled, width, height), False))
+
+def _stroke_to_dict(stroke):
+    """Convert a stroke to its file representation (map-local points)."""
+    return {'color': stroke['color'], 'size': stroke['size'], 'points': stroke['pts'][:stroke['count']]}
 
 class MapManager:
     """
@@ -26,14 +131,23 @@ class MapManager:
         
         # Map loading and tracking
         self.map_files = []
+        self._map_index = {}  # Path -> position in map_files
         self.current_map_index = 0
         self.current_map = None
+        self._current_map_basename = None
+        self._current_annotation_filename = None
         self.current_map_surface = None
         self.map_position = (0, 0)
+        self._pending_map = None  # Map to load on first draw
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1)
         
         # Annotations
         self.annotations_surface = None
         self.annotation_points = []
+        self._committed_strokes = 0  # Strokes already appended to the file
+        self._annotation_log = None
+        self._annotations_dirty = False  # Whole file needs rewriting
+        self._last_annotation_flush = time.monotonic()
         
         # State tracking
         self.drawing_enabled = True
@@ -42,59 +156,132 @@ class MapManager:
         self.grid_color = tuple(config.get("grid_color", [100, 100, 100, 128]))
         self.grid_offset = (0, 0)
         
+        # Cached grid overlay, rebuilt only when its parameters change
+        self._grid_cache = None
+        self._grid_cache_key = None
+        self._grid_buffer = None
+        
+        # Map, grid and annotations flattened into one surface for display
+        self._composite_surface = None
+        self._composite_dirty = True
+        self._annot_dirty_rects = []  # Map-local areas with new annotation strokes
+        
+        # Make sure pending annotations reach the disk on exit
+        atexit.register(self.flush_annotations, force=True)
+        
         # Load map files
         self.refresh_map_list()
     
     def refresh_map_list(self):
         """Refresh the list of available map files."""
         self.map_files = get_image_files(self.maps_directory)
+        self._map_index = {path: i for i, path in enumerate(self.map_files)}
         
         # Reset to first map if no current map or out of bounds
         if not self.map_files:
             self.current_map_index = 0
-            self.current_map = None
-        elif self.current_map not in self.map_files:
+            self._set_current_map(None)
+            self._pending_map = None
+        elif self.current_map not in self._map_index:
+            # Defer decoding until the map is actually displayed
             self.current_map_index = 0
-            self.load_map(self.map_files[0] if self.map_files else None)
+            self._pending_map = self.map_files[0]
+    
+    def set_screen(self, screen):
+        """Switch to a new display surface, e.g. after toggling fullscreen."""
+        self.screen = screen
+        
+        # Cached maps were scaled and converted for the old display
+        with _MAP_CACHE_LOCK:
+            _MAP_CACHE.clear()
+        self._grid_cache_key = None
+        self._composite_dirty = True
+        
+        # Reload the current map for the new display on its next draw
+        if self.current_map:
+            self._pending_map = self.current_map
+    
+    def _ensure_loaded(self):
+        """Load the pending map, if any, before it is first displayed."""
+        if self._pending_map:
+            self.load_map(self._pending_map)
     
     def load_map(self, map_path):
         """Load a specific map by path."""
+        self._pending_map = None
+        
+        # Persist the outgoing map's annotations before they are replaced
+        self.flush_annotations(force=True)
+        self._close_annotation_log()
+        
         if not map_path or not os.path.exists(map_path):
-            self.current_map = None
+            self._set_current_map(None)
             self.current_map_surface = None
             return False
             
-        # Load the map image
-        surface = load_image(map_path)
-        if not surface:
+        screen_rect = self.screen.get_rect()
+        cached = _load_scaled_map(map_path, screen_rect.width, screen_rect.height)
+        if not cached:
             return False
             
         # Update state
-        self.current_map = map_path
-        if self.map_files and map_path in self.map_files:
-            self.current_map_index = self.map_files.index(map_path)
+        self._set_current_map(map_path)
+        index = self._map_index.get(map_path)
+        if index is not None:
+            self.current_map_index = index
+        self.current_map_surface, self.map_position = cached
         
-        # Scale the map to fit the screen if needed
-        screen_rect = self.screen.get_rect()
-        self.current_map_surface = scale_image_to_fit(surface, screen_rect.width, screen_rect.height)
-        
-        # Center the map on screen
-        map_rect = self.current_map_surface.get_rect()
-        self.map_position = ((screen_rect.width - map_rect.width) // 2, 
-                            (screen_rect.height - map_rect.height) // 2)
+        # Grid geometry depends on the map size
+        self._grid_cache_key = None
+        self._composite_dirty = True
         
         # Create a new annotations surface
-        self.annotations_surface = pygame.Surface(self.current_map_surface.get_size(), pygame.SRCALPHA)
+        self.annotations_surface = pygame.Surface(self.current_map_surface.get_size(), pygame.SRCALPHA).convert_alpha()
         self.annotations_surface.fill((0, 0, 0, 0))  # Transparent
         
         # Reset annotation points
         self.annotation_points = []
+        self._committed_strokes = 0
         
         # Try to load saved annotations
         self.load_annotations()
         
+        # Warm the cache for the maps the user is most likely to open next
+        self._prefetch_neighbors()
+        
         return True
     
+    def _set_current_map(self, map_path):
+        """Set the current map and the file names derived from its path."""
+        self.current_map = map_path
+        if not map_path:
+            self._current_map_basename = None
+            self._current_annotation_filename = None
+            return
+            
+        # Get map filename without path or extension
+        self._current_map_basename = os.path.basename(map_path)
+        map_name = os.path.splitext(self._current_map_basename)[0]
+        self._current_annotation_filename = os.path.join(self.annotations_directory, f"{map_name}_annotations.jsonl")
+    
+    def _prefetch_neighbors(self):
+        """Decode and scale the previous and next maps in the background."""
+        if len(self.map_files) < 2:
+            return
+            
+        screen_size = self.screen.get_size()
+        for step in (1, -1):
+            neighbor = self.map_files[(self.current_map_index + step) % len(self.map_files)]
+            if neighbor != self.current_map:
+                self._prefetch_executor.submit(self._prefetch, neighbor, *screen_size)
+    
+    def _prefetch(self, map_path, width, height):
+        """Load a map into the cache without touching the display."""
+        try:
+            _prefetch_scaled_map(map_path, width, height)
+        except Exception as e:
+            print(f"Error prefetching map {map_path}: {e}")
+    
     def next_map(self):
         """Switch to the next map in the list."""
         if not self.map_files:
@@ -113,15 +300,16 @@ class MapManager:
     
     def get_annotation_filename(self):
         """Get the filename for the current map's annotations."""
-        if not self.current_map:
-            return None
-            
-        # Get map filename without path or extension
-        map_name = os.path.splitext(os.path.basename(self.current_map))[0]
-        return os.path.join(self.annotations_directory, f"{map_name}_annotations.json")
+        return self._current_annotation_filename
+    
+    def _close_annotation_log(self):
+        """Close the append handle for the current map's annotation file."""
+        if self._annotation_log:
+            self._annotation_log.close()
+            self._annotation_log = None
     
     def save_annotations(self):
-        """Save the current annotations to file."""
+        """Rewrite the whole annotation file, compacting the stroke log."""
         if not self.current_map:
             return False
             
@@ -130,26 +318,101 @@ class MapManager:
             return False
             
         try:
-            # Save annotation points (color, size, points)
-            with open(annotation_file, 'w') as f:
-                json.dump(self.annotation_points, f)
+            # Save one stroke (color, size, points) per line, replacing the
+            # old file atomically so a crash never leaves it truncated
+            self._close_annotation_log()
+            tmp_file = annotation_file + ".tmp"
+            with open(tmp_file, 'wb') as f:
+                for stroke in self.annotation_points:
+                    f.write(serialization.dumps(_stroke_to_dict(stroke)) + b"\n")
+            os.replace(tmp_file, annotation_file)
+            self._committed_strokes = len(self.annotation_points)
+            self._annotations_dirty = False
+            return True
+        except Exception as e:
+            print(f"Error saving annotations: {e}")
+            return False
+    
+    def commit_stroke(self):
+        """Finish the current stroke and append any unsaved strokes to the file."""
+        pending = self.annotation_points[self._committed_strokes:]
+        if not pending:
+            return False
+            
+        # Round off the end of the stroke being finished
+        self._cap_stroke(pending[-1])
+            
+        # A pending rewrite already covers these strokes
+        if self._annotations_dirty:
+            return self.save_annotations()
+            
+        try:
+            if not self._annotation_log:
+                self._annotation_log = open(self.get_annotation_filename(), 'ab')
+            for stroke in pending:
+                self._annotation_log.write(serialization.dumps(_stroke_to_dict(stroke)) + b"\n")
+            self._annotation_log.flush()
+            self._committed_strokes = len(self.annotation_points)
             return True
         except Exception as e:
             print(f"Error saving annotations: {e}")
             return False
     
+    def flush_annotations(self, force=False):
+        """Save annotation changes; rewrites happen at most every few seconds unless forced."""
+        if not self._annotations_dirty:
+            return self.commit_stroke() if force else False
+            
+        now = time.monotonic()
+        if not force and now - self._last_annotation_flush < ANNOTATION_FLUSH_INTERVAL:
+            return False
+            
+        self._last_annotation_flush = now
+        return self.save_annotations()
+    
     def load_annotations(self):
         """Load annotations for the current map."""
         if not self.current_map:
             return False
             
         annotation_file = self.get_annotation_filename()
-        if not annotation_file or not os.path.exists(annotation_file):
+        if not annotation_file:
+            return False
+            
+        # Fall back to the single-document format used by older versions
+        legacy_file = os.path.splitext(annotation_file)[0] + ".json"
+        if not os.path.exists(annotation_file) and not os.path.exists(legacy_file):
             return False
             
         try:
-            with open(annotation_file, 'r') as f:
-                self.annotation_points = json.load(f)
+            if os.path.exists(annotation_file):
+                with open(annotation_file, 'rb') as f:
+                    data = [serialization.loads(line) for line in f if line.strip()]
+            else:
+                with open(legacy_file, 'rb') as f:
+                    data = serialization.loads(f.read())
+                    
+            # Strokes saved as [color, size, points] lists by older versions
+            # use screen coordinates; translate them to map-local once here
+            origin = np.asarray(self.map_position, dtype=np.int32)
+            self.annotation_points = []
+            has_legacy = not os.path.exists(annotation_file)
+            for entry in data:
+                if isinstance(entry, dict):
+                    color, size, points = entry['color'], entry['size'], entry['points']
+                else:
+                    color, size, points = entry
+                    
+                # Convert color from list to tuple so strokes can be continued
+                stroke = _new_stroke(tuple(color) if isinstance(color, list) else color, size, points)
+                if not isinstance(entry, dict):
+                    stroke['pts'][:stroke['count']] -= origin
+                    has_legacy = True
+                self.annotation_points.append(stroke)
+            self._committed_strokes = len(self.annotation_points)
+            
+            # Legacy annotations are rewritten in the new format on next flush
+            self._annotations_dirty = has_legacy
                 
             # Redraw the annotations
             self.redraw_annotations()
@@ -163,6 +426,9 @@ class MapManager:
         if self.annotations_surface:
             self.annotations_surface.fill((0, 0, 0, 0))  # Transparent
             self.annotation_points = []
+            self._committed_strokes = 0
+            self._annotations_dirty = True
+            self._composite_dirty = True
             return True
         return False
     
@@ -171,27 +437,51 @@ class MapManager:
         if not self.drawing_enabled or not self.current_map:
             return False
             
-        # Add the point to the list
-        if not self.annotation_points or self.annotation_points[-1][0] != color or self.annotation_points[-1][1] != size:
-            # Start new stroke
-            self.annotation_points.append([color, size, [point]])
+        # Points are stored relative to the map's top-left corner
+        rel_point = (point[0] - self.map_position[0], point[1] - self.map_position[1])
+            
+        # Add the point to the list; strokes already written out are closed
+        stroke = None
+        if len(self.annotation_points) > self._committed_strokes:
+            stroke = self.annotation_points[-1]
+        if not stroke or stroke['color'] != color or stroke['size'] != size:
+            # Finish the previous stroke and start a new one
+            self.commit_stroke()
+            stroke = _new_stroke(color, size, [rel_point])
+            self.annotation_points.append(stroke)
         else:
             # Add to existing stroke
-            self.annotation_points[-1][2].append(point)
+            _append_point(stroke, rel_point)
             
-        # Draw the point
-        rel_point = (point[0] - self.map_position[0], point[1] - self.map_position[1])
-        pygame.draw.circle(self.annotations_surface, color, rel_point, size // 2)
+        # Draw the point; interior points are covered by the connecting line,
+        # so only the start of a stroke gets a round cap here
+        changed = pygame.Rect(rel_point, (1, 1))
+        count = stroke['count']
+        if count == 1:
+            pygame.draw.circle(self.annotations_surface, color, rel_point, size // 2)
         
         # If continuing a stroke, draw a line from the previous point
-        points = self.annotation_points[-1][2]
-        if len(points) > 1:
-            prev_point = points[-2]
-            prev_rel_point = (prev_point[0] - self.map_position[0], prev_point[1] - self.map_position[1])
+        if count > 1:
+            prev_rel_point = tuple(stroke['pts'][count - 2].tolist())
             pygame.draw.line(self.annotations_surface, color, prev_rel_point, rel_point, size)
+            changed.union_ip(pygame.Rect(prev_rel_point, (1, 1)))
+            
+        # Only the area around the new segment needs compositing again
+        self._annot_dirty_rects.append(changed.inflate(size + 2, size + 2))
         
         return True
     
+    def _cap_stroke(self, stroke):
+        """Draw the round cap at the last point of a stroke."""
+        count = stroke['count']
+        if count < 2 or not self.annotations_surface:
+            return
+            
+        rel_point = tuple(stroke['pts'][count - 1].tolist())
+        size = stroke['size']
+        pygame.draw.circle(self.annotations_surface, stroke['color'], rel_point, size // 2)
+        self._annot_dirty_rects.append(pygame.Rect(rel_point, (1, 1)).inflate(size + 2, size + 2))
+    
     def redraw_annotations(self):
         """Redraw all annotations from saved points."""
         if not self.annotations_surface:
@@ -199,84 +489,113 @@ class MapManager:
             
         # Clear the surface
         self.annotations_surface.fill((0, 0, 0, 0))
+        self._composite_dirty = True
         
-        # Redraw each stroke
-        for color_str, size, points in self.annotation_points:
-            # Convert color from list/string to tuple if needed
-            color = tuple(color_str) if isinstance(color_str, list) else color_str
+        # Redraw each stroke; points are already relative to the map
+        for stroke in self.annotation_points:
+            count = stroke['count']
+            if not count:
+                continue
+            color = stroke['color']
+            size = stroke['size']
+            rel_points = stroke['pts'][:count].tolist()
             
-            # Draw each point in the stroke
-            for i, point in enumerate(points):
-                # Adjust point position relative to map
-                rel_point = (point[0] - self.map_position[0], point[1] - self.map_position[1])
-                
-                # Draw the point
-                pygame.draw.circle(self.annotations_surface, color, rel_point, size // 2)
-                
-                # Draw a line to the previous point
-                if i > 0:
-                    prev_point = points[i-1]
-                    prev_rel_point = (prev_point[0] - self.map_position[0], prev_point[1] - self.map_position[1])
-                    pygame.draw.line(self.annotations_surface, color, prev_rel_point, rel_point, size)
+            # Draw the whole stroke at once, rounding off its ends
+            if count > 1:
+                pygame.draw.lines(self.annotations_surface, color, False, rel_points, size)
+            pygame.draw.circle(self.annotations_surface, color, rel_points[0], size // 2)
+            pygame.draw.circle(self.annotations_surface, color, rel_points[-1], size // 2)
     
     def toggle_grid(self):
         """Toggle the grid overlay."""
         self.grid_enabled = not self.grid_enabled
+        self._composite_dirty = True
         return self.grid_enabled
     
     def set_grid_size(self, size):
         """Set the grid size."""
         self.grid_size = max(10, min(200, size))  # Clamp between 10 and 200
+        self._grid_cache_key = None
+        self._composite_dirty = True
         return self.grid_size
     
     def set_grid_offset(self, offset):
         """Set the grid offset."""
         self.grid_offset = offset
+        self._grid_cache_key = None
+        self._composite_dirty = True
     
     def draw_grid(self):
         """Draw the grid overlay."""
         if not self.grid_enabled or not self.current_map_surface:
             return
             
-        map_rect = self.current_map_surface.get_rect()
-        map_rect.topleft = self.map_position
+        # Blit the grid onto the screen at map position
+        self.screen.blit(self._get_grid_surface(), self.map_position)
+    
+    def _get_grid_surface(self):
+        """Get the grid overlay for the current map, rendering it if needed."""
+        size = self.current_map_surface.get_size()
         
-        # Create a grid overlay surface
-        grid_surface = pygame.Surface(map_rect.size, pygame.SRCALPHA)
+        # Reuse the cached grid if nothing affecting it has changed
+        key = (size, self.grid_size, self.grid_color, tuple(self.grid_offset))
+        if key != self._grid_cache_key:
+            self._grid_cache = self._render_grid(size)
+            self._grid_cache_key = key
+        return self._grid_cache
+    
+    def _render_grid(self, size):
+        """Rasterize the grid lines into an RGBA buffer and wrap it as a surface."""
+        width, height = size
         
-        # Draw horizontal lines
-        y = self.grid_offset[1] % self.grid_size
-        while y < map_rect.height:
-            pygame.draw.line(grid_surface, self.grid_color, (0, y), (map_rect.width, y))
-            y += self.grid_size
-            
-        # Draw vertical lines
-        x = self.grid_offset[0] % self.grid_size
-        while x < map_rect.width:
-            pygame.draw.line(grid_surface, self.grid_color, (x, 0), (x, map_rect.height))
-            x += self.grid_size
-            
-        # Blit the grid onto the screen at map position
-        self.screen.blit(grid_surface, map_rect.topleft)
+        # Reuse the pixel buffer while the map size stays the same
+        if self._grid_buffer is None or self._grid_buffer.shape[:2] != (height, width):
+            self._grid_buffer = np.zeros((height, width, 4), dtype=np.uint8)
+        else:
+            self._grid_buffer.fill(0)
+        buf = self._grid_buffer
+        color = tuple(pygame.Color(*self.grid_color))
+        
+        # Draw horizontal and vertical lines as strided slice assignments
+        buf[self.grid_offset[1] % self.grid_size::self.grid_size, :] = color
+        buf[:, self.grid_offset[0] % self.grid_size::self.grid_size] = color
+        
+        # convert_alpha() copies the pixels, so the buffer can be reused
+        return pygame.image.frombuffer(buf, (width, height), 'RGBA').convert_alpha()
     
     def draw(self):
-        """Draw the current map to the screen."""
+        """Draw the current map to the screen with its grid and annotations."""
+        self._ensure_loaded()
         if not self.current_map_surface:
             # Draw a black background if no map is loaded
             self.screen.fill((0, 0, 0))
             return False
             
-        # Draw the map
-        self.screen.blit(self.current_map_surface, self.map_position)
-        
-        # Draw the grid if enabled (handled separately in main.py)
-        # if self.grid_enabled:
-        #     self.draw_grid()
+        # Flatten map, grid and annotations again only after they change
+        if self._composite_dirty:
+            self._composite_surface = self.current_map_surface.copy()
+            if self.grid_enabled:
+                self._composite_surface.blit(self._get_grid_surface(), (0, 0))
+            if self.annotations_surface:
+                self._composite_surface.blit(self.annotations_surface, (0, 0))
+            self._composite_dirty = False
+            self._annot_dirty_rects.clear()
+        elif self._annot_dirty_rects:
+            # Patch in fresh annotation strokes without a full rebuild
+            for rect in self._annot_dirty_rects:
+                self._composite_surface.blit(self.current_map_surface, rect, area=rect)
+                if self.grid_enabled:
+                    self._composite_surface.blit(self._get_grid_surface(), rect, area=rect)
+                self._composite_surface.blit(self.annotations_surface, rect, area=rect)
+            self._annot_dirty_rects.clear()
             
+        # Draw the map with its overlays in a single blit
+        self.screen.blit(self._composite_surface, self.map_position)
         return True
     
     def draw_map_only(self):
         """Draw just the current map to the screen without annotations."""
+        self._ensure_loaded()
         if not self.current_map_surface:
             # Draw a black background if no map is loaded
             self.screen.fill((0, 0, 0))
@@ -5,25 +5,108 @@ Handles character and monster tokens on the battlefield.
 
 import os
 import pygame
-import json
-from ..utils.image import load_image, get_image_files
+import pygame.freetype
+import numpy as np
+from collections import OrderedDict, Counter
+from ..utils.image import load_image, get_image_files, blit_sequence, clip_to_circle
+from ..utils import serialization
+
+# Selection rings shared by all tokens: size -> surface (read-only)
+_RING_CACHE = {}
+
+def _get_selection_ring(size):
+    """Get the cached selection ring for a token size, centered in its surface."""
+    ring = _RING_CACHE.get(size)
+    if ring is None:
+        radius = size // 2 + 2  # Radius slightly larger than token
+        ring = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+        pygame.draw.circle(ring, (0, 255, 255), (radius, radius), radius, 2)  # Cyan, 2px border
+        _RING_CACHE[size] = ring
+    return ring
+
+# Decoded token images shared by all tokens: image_path -> surface (read-only)
+_ORIGINAL_CACHE = OrderedDict()
+_ORIGINAL_CACHE_SIZE = 64
+
+def _load_original(image_path):
+    """Load a token image, decoding each file only once while it stays cached."""
+    original = _ORIGINAL_CACHE.get(image_path)
+    if original is None:
+        # Match the display's alpha format once, so scaling and blitting
+        # never convert pixels (load_image's fallback is an opaque surface)
+        original = load_image(image_path)
+        if not original.get_flags() & pygame.SRCALPHA:
+            original = original.convert_alpha()
+        _ORIGINAL_CACHE[image_path] = original
+        if len(_ORIGINAL_CACHE) > _ORIGINAL_CACHE_SIZE:
+            _ORIGINAL_CACHE.popitem(last=False)
+    else:
+        _ORIGINAL_CACHE.move_to_end(image_path)
+    return original
+
+# Fonts opened so far: (name, size) -> font
+_FONT_CACHE = {}
+
+def _get_font(name, size):
+    """Get a system freetype font, opening each name and size only once."""
+    font = _FONT_CACHE.get((name, size))
+    if font is None:
+        if not pygame.freetype.get_init():
+            pygame.freetype.init()
+        font = pygame.freetype.SysFont(name, size)
+        font.pad = True  # Keep label heights independent of the glyphs used
+        _FONT_CACHE[(name, size)] = font
+    return font
+
+# Scale ratios between which plain scaling is used instead of smoothscale
+SMOOTHSCALE_MIN_RATIO = 0.75
+SMOOTHSCALE_MAX_RATIO = 1.5
+
+def _build_circular(original, size):
+    """Scale an image to size and cut it to a circle."""
+    
+    # Near 1:1 nearest-neighbour scaling looks the same and is much cheaper;
+    # larger changes need smoothscale to avoid aliasing
+    src_size = max(original.get_size())
+    if src_size * SMOOTHSCALE_MIN_RATIO <= size <= src_size * SMOOTHSCALE_MAX_RATIO:
+        circular_image = pygame.transform.scale(original, (size, size))
+    else:
+        circular_image = pygame.transform.smoothscale(original, (size, size))
+    
+    clip_to_circle(circular_image)
+    return circular_image
 
 class Token:
     """
     Represents a single token on the map (character, monster, etc.)
     """
     
+    # Fixed attribute layout: no per-instance __dict__
+    __slots__ = (
+        'original_image', 'image_path', 'position', 'size', '_radius_sq', 'name',
+        'selected', 'visible', 'dragging', 'drag_offset', 'image',
+        '_name_surface', '_manager', '_topleft', '_rect'
+    )
+    
+    # Circular images shared by all tokens: (image_path, size) -> surface
+    _image_cache = OrderedDict()
+    _image_cache_size = 128
+    
     def __init__(self, image_path, position, size=50, name="Token"):
         """Initialize a token."""
-        self.original_image = load_image(image_path)
+        self.original_image = _load_original(image_path)
         self.image_path = image_path
         self.position = position  # Center position
         self.size = size
+        self._radius_sq = (size // 2) ** 2
         self.name = name
         self.selected = False
         self.visible = True
         self.dragging = False
         self.drag_offset = (0, 0)
+        self._name_surface = None  # Rendered name label, built on first draw
+        self._manager = None  # Owning TokenManager, told about geometry changes
+        self._update_topleft()
         
         # Process image
         self.update_image()
@@ -31,43 +114,65 @@ class Token:
     def update_image(self):
         """Update the token image with current size."""
         if self.original_image:
-            self.image = pygame.transform.smoothscale(self.original_image, (self.size, self.size))
+            # Tokens sharing an image and size share one read-only surface
+            key = (self.image_path, self.size)
+            image = Token._image_cache.get(key)
+            if image is None:
+                image = _build_circular(self.original_image, self.size)
+                Token._image_cache[key] = image
+                if len(Token._image_cache) > Token._image_cache_size:
+                    Token._image_cache.popitem(last=False)
+            else:
+                Token._image_cache.move_to_end(key)
+            self.image = image
         else:
             # Create a blank surface as fallback
             self.image = pygame.Surface((self.size, self.size))
             self.image.fill((200, 0, 0))  # Red for error
     
+    def _update_topleft(self):
+        """Cache the blit position and bounds for the current center and size."""
+        self._topleft = (
+            self.position[0] - self.size // 2,
+            self.position[1] - self.size // 2
+        )
+        self._rect = pygame.Rect(self._topleft, (self.size, self.size))
+        if self._manager:
+            self._manager._geometry_dirty = True
+    
     def set_position(self, position):
         """Set the token position (center point)."""
         self.position = position
+        self._update_topleft()
     
     def set_size(self, size):
         """Set the token size and update image."""
         self.size = max(10, min(200, size))  # Clamp between 10 and 200
+        self._radius_sq = (self.size // 2) ** 2
+        self._update_topleft()
         self.update_image()
     
     def set_name(self, name):
         """Set the token name."""
         self.name = name
+        self._name_surface = None
     
     def toggle_visibility(self):
         """Toggle token visibility."""
         self.visible = not self.visible
+        if self._manager:
+            self._manager._geometry_dirty = True
         return self.visible
     
     def contains_point(self, point):
         """Check if a point is within this circular token."""
-        if not self.visible or not self.image:
+        if not self.visible:
             return False
             
-        # Calculate distance from token center to point
+        # Compare squared distance from the token center against the radius
         dx = self.position[0] - point[0]
         dy = self.position[1] - point[1]
-        distance_squared = dx*dx + dy*dy
-        
-        # Check if distance is less than radius
-        radius = self.size // 2
-        return distance_squared <= radius*radius
+        return dx*dx + dy*dy <= self._radius_sq
     
     def start_drag(self, mouse_pos):
         """Start dragging this token."""
@@ -91,6 +196,7 @@ class Token:
             mouse_pos[0] + self.drag_offset[0],
             mouse_pos[1] + self.drag_offset[1]
         )
+        self._update_topleft()
         return True
     
     def end_drag(self):
@@ -103,48 +209,42 @@ class Token:
         if not self.visible or not self.image:
             return
             
-        # Calculate position (centered)
-        pos = (
-            self.position[0] - self.size // 2,
-            self.position[1] - self.size // 2
-        )
-        
-        # Create a circular mask
-        mask = pygame.Surface((self.size, self.size), pygame.SRCALPHA)
-        pygame.draw.circle(mask, (255, 255, 255, 255), (self.size // 2, self.size // 2), self.size // 2)
-        
-        # Apply the mask to the token image
-        circular_image = pygame.Surface((self.size, self.size), pygame.SRCALPHA)
-        circular_image.blit(self.image, (0, 0))
-        circular_image.blit(mask, (0, 0), special_flags=pygame.BLEND_RGBA_MIN)
-        
         # Draw the circular token
-        surface.blit(circular_image, pos)
-        
+        surface.blit(self.image, self._topleft)
+        self.draw_decorations(surface)
+    
+    def draw_decorations(self, surface):
+        """Draw the selection indicator and name label for this token."""
         # Draw selection indicator if selected
         if self.selected:
-            pygame.draw.circle(
-                surface, 
-                (0, 255, 255),  # Cyan
-                self.position,  # Center position
-                self.size // 2 + 2,  # Radius slightly larger than token
-                2  # Border width
-            )
+            ring = _get_selection_ring(self.size)
+            surface.blit(ring, ring.get_rect(center=self.position))
             
         # Draw name above token
         if self.name:
-            font = pygame.font.SysFont('Arial', 12)
-            text = font.render(self.name, True, (255, 255, 255))
-            text_rect = text.get_rect(center=(self.position[0], pos[1] - 10))
-            
-            # Draw background for better visibility
-            bg_rect = text_rect.inflate(10, 6)
-            bg_surface = pygame.Surface((bg_rect.width, bg_rect.height), pygame.SRCALPHA)
-            bg_surface.fill((0, 0, 0, 160))  # Semi-transparent black
-            surface.blit(bg_surface, bg_rect.topleft)
+            label = self._get_name_surface()
+            surface.blit(label, label.get_rect(center=(self.position[0], self._topleft[1] - 10)))
+    
+    def get_draw_rect(self):
+        """Get the screen area covered by this token, its selection ring and its label."""
+        rect = self._rect.inflate(6, 6)
+        if self.name:
+            label = self._get_name_surface()
+            rect.union_ip(label.get_rect(center=(self.position[0], self._topleft[1] - 10)))
+        return rect
+    
+    def _get_name_surface(self):
+        """Get the name label with its background, rendering it only after a change."""
+        if self._name_surface is None:
+            font = _get_font('Arial', 12)
+            text_rect = font.get_rect(self.name)
             
-            # Draw text
-            surface.blit(text, text_rect)
+            # Draw background for better visibility, then the text straight onto it
+            label = pygame.Surface(text_rect.inflate(10, 6).size, pygame.SRCALPHA)
+            label.fill((0, 0, 0, 160))  # Semi-transparent black
+            font.render_to(label, (5, 3), self.name, (255, 255, 255))
+            self._name_surface = label
+        return self._name_surface
     
     def to_dict(self):
         """Convert token to dictionary for serialization."""
@@ -185,13 +285,34 @@ class TokenManager:
         
         # Token state
         self.tokens = []
+        self._token_set = set()  # Same tokens, for O(1) membership checks
+        self._name_counts = Counter()  # Image base name -> highest number handed out
         self.selected_token = None
         self.tokens_visible = True
         self.available_tokens = []
         
+        # Token centers and squared radii for vectorized hit tests,
+        # rebuilt lazily after any token moves, resizes or is added/removed
+        self._pos = np.empty((0, 2), dtype=np.float32)
+        self._r2 = np.empty(0, dtype=np.float32)
+        self._geometry_dirty = False
+        
         # Load available token images
         self.refresh_token_list()
     
+    def set_screen(self, screen):
+        """Switch to a new display surface, e.g. after toggling fullscreen."""
+        self.screen = screen
+        
+        # Cached images were converted to the old display's pixel format
+        _ORIGINAL_CACHE.clear()
+        Token._image_cache.clear()
+        _RING_CACHE.clear()
+        for token in self.tokens:
+            token.original_image = _load_original(token.image_path)
+            token.update_image()
+            token._name_surface = None
+    
     def refresh_token_list(self):
         """Refresh the list of available token images."""
         self.available_tokens = get_image_files(self.tokens_directory)
@@ -201,41 +322,84 @@ class TokenManager:
         # Generate name if not provided
         if not name:
             base_name = os.path.splitext(os.path.basename(image_path))[0]
-            existing_count = sum(1 for token in self.tokens if token.name.startswith(base_name))
+            existing_count = self._name_counts[base_name]
             if existing_count > 0:
                 name = f"{base_name} {existing_count + 1}"
             else:
                 name = base_name
+            self._name_counts[base_name] = existing_count + 1
         
         # Create and add the token
         token = Token(image_path, position, size, name)
+        token._manager = self
         self.tokens.append(token)
+        self._token_set.add(token)
+        self._geometry_dirty = True
         return token
     
     def remove_token(self, token):
         """Remove a token from the battlefield."""
-        if token in self.tokens:
+        if token in self._token_set:
+            # list.remove keeps the draw (z) order of the remaining tokens
+            self._token_set.discard(token)
             self.tokens.remove(token)
+            token._manager = None
+            self._geometry_dirty = True
             if self.selected_token == token:
                 self.selected_token = None
             return True
         return False
     
+    def _rebuild_name_counts(self):
+        """Recover the highest generated number per image from token names."""
+        self._name_counts = Counter()
+        for token in self.tokens:
+            base_name = os.path.splitext(os.path.basename(token.image_path))[0]
+            suffix = token.name[len(base_name):].strip() if token.name.startswith(base_name) else None
+            if suffix == "":
+                number = 1
+            elif suffix and suffix.isdigit():
+                number = int(suffix)
+            else:
+                continue
+            self._name_counts[base_name] = max(self._name_counts[base_name], number)
+    
+    def select_token(self, token):
+        """Select a token (or None), deselecting the previously selected one."""
+        if self.selected_token and self.selected_token is not token:
+            self.selected_token.selected = False
+        self.selected_token = token
+        if token:
+            token.selected = True
+    
     def get_token_at(self, position):
         """Get the topmost token at the given position."""
-        # Check tokens in reverse order (top to bottom)
-        for token in reversed(self.tokens):
-            if token.contains_point(position):
-                return token
-        return None
+        if self._geometry_dirty:
+            self._rebuild_geometry()
+            
+        # Test all tokens at once; later tokens are drawn on top
+        d = self._pos - np.asarray(position, dtype=np.float32)
+        hits = np.flatnonzero(np.einsum('ij,ij->i', d, d) <= self._r2)
+        return self.tokens[hits[-1]] if hits.size else None
+    
+    def _rebuild_geometry(self):
+        """Rebuild the hit-test arrays from the token list."""
+        self._pos = np.array([token.position for token in self.tokens], dtype=np.float32).reshape(-1, 2)
+        
+        # Hidden tokens get a negative radius so they never match
+        self._r2 = np.array(
+            [token._radius_sq if token.visible else -1 for token in self.tokens],
+            dtype=np.float32
+        )
+        self._geometry_dirty = False
     
     def save_tokens(self, filename):
         """Save tokens to a file."""
         token_data = [token.to_dict() for token in self.tokens]
         
         try:
-            with open(filename, 'w') as f:
-                json.dump(token_data, f)
+            with open(filename, 'wb') as f:
+                f.write(serialization.dumps(token_data))
             return True
         except Exception as e:
             print(f"Error saving tokens: {e}")
@@ -247,16 +411,21 @@ class TokenManager:
             return False
             
         try:
-            with open(filename, 'r') as f:
-                token_data = json.load(f)
+            with open(filename, 'rb') as f:
+                token_data = serialization.loads(f.read())
                 
             # Clear existing tokens
             self.tokens = []
+            self._token_set = set()
             
             # Create new tokens
             for data in token_data:
                 token = Token.from_dict(data)
+                token._manager = self
                 self.tokens.append(token)
+                self._token_set.add(token)
+            self._geometry_dirty = True
+            self._rebuild_name_counts()
                 
             return True
         except Exception as e:
@@ -268,5 +437,13 @@ class TokenManager:
         if not self.tokens_visible:
             return
             
-        for token in self.tokens:
-            token.draw(self.screen)
\ No newline at end of file
+        # Blit all on-screen token images in one call, then the few decorations on top
+        screen_rect = self.screen.get_clip()
+        visible = [
+            token for token in self.tokens
+            if token.visible and token.image and screen_rect.colliderect(token._rect)
+        ]
+        blit_sequence(self.screen, [(token.image, token._topleft) for token in visible])
+        for token in visible:
+            if token.selected or token.name:
+                token.draw_decorations(self.screen)
\ No newline at end of file
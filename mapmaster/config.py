@@ -1,5 +1,6 @@
 import os
 import json
+import time
 import shutil
 
 # Default configuration
@@ -11,6 +12,8 @@ DEFAULT_CONFIG = {
     "tokens_directory": "assets/tokens",
     "annotations_directory": "annotations",
     "port": 5000,
+    "stream_max_width": 1280,  # Streamed frames are downscaled to this width (0 = full size)
+    "max_stream_clients": 32,  # Simultaneous /stream viewers; more get a 503
     "grid_enabled": False,
     "grid_size": 50,
     "grid_color": [100, 100, 100, 128],  # RGBA
@@ -18,11 +21,16 @@ DEFAULT_CONFIG = {
 
 CONFIG_FILE = "config.json"
 
+# Minimum seconds between writes of changed settings
+CONFIG_FLUSH_INTERVAL = 1.0
+
 class Config:
     """Configuration manager for MapMaster."""
     
     def __init__(self):
         self.data = {}
+        self._dirty = False
+        self._last_flush = 0.0
         self.load()
         
     def load(self):
@@ -50,16 +58,33 @@ class Config:
     def save(self):
         """Save current configuration to file."""
         try:
-            with open(CONFIG_FILE, 'w') as f:
+            # Write a temporary file and swap it in so a crash never truncates the config
+            tmp_file = CONFIG_FILE + ".tmp"
+            with open(tmp_file, 'w') as f:
                 json.dump(self.data, f, indent=2)
+            os.replace(tmp_file, CONFIG_FILE)
+            self._dirty = False
         except Exception as e:
             print(f"Error saving config: {e}")
     
+    def flush(self, force=False):
+        """Save pending changes; writes happen at most once per interval unless forced."""
+        if not self._dirty:
+            return False
+            
+        now = time.monotonic()
+        if not force and now - self._last_flush < CONFIG_FLUSH_INTERVAL:
+            return False
+            
+        self._last_flush = now
+        self.save()
+        return True
+    
     def get(self, key, default=None):
         """Get a configuration value."""
         return self.data.get(key, default)
     
     def set(self, key, value):
-        """Set a configuration value and save."""
+        """Set a configuration value; it is written out on the next flush."""
         self.data[key] = value
-        self.save()
\ No newline at end of file
+        self._dirty = True
\ No newline at end of file
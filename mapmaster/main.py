@@ -9,7 +9,9 @@ import pygame
 from pygame.locals import *
 import argparse
 import threading
+import queue
 import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
 from .config import Config
 from .utils.network import get_local_ip, find_free_port
@@ -37,6 +39,12 @@ DEFAULT_BRUSH_SIZES = {
     "Huge": 25
 }
 
+# Seconds a server thread waits for the main loop to run its command
+COMMAND_TIMEOUT = 5.0
+
+# Above this fraction of the screen, dirty rects are presented with a full flip
+DIRTY_AREA_FLIP_RATIO = 0.25
+
 # Command overlay text
 DEFAULT_COMMANDS = [
     "== MapMaster Controls ==",
@@ -58,9 +66,12 @@ DEFAULT_COMMANDS = [
     "Right-click: Deselect token",
     "",
     "== Network ==",
-    f"Connect from mobile devices at: http://<SERVER_IP>:<PORT>"
 ]
 
+def build_help_text(ip="<SERVER_IP>", port="<PORT>"):
+    """Build the help overlay lines, including the address players connect to."""
+    return DEFAULT_COMMANDS + [f"Connect from mobile devices at: http://{ip}:{port}"]
+
 class MapMasterApp:
     """Main application class for MapMaster."""
     
@@ -86,13 +97,14 @@ class MapMasterApp:
         # Initialize Pygame
         pygame.init()
         pygame.display.set_caption("MapMaster")
+        self._big_font = pygame.font.SysFont('Arial', 36)
         
         # Set up display
         self.setup_display()
         
         # Initialize components
         self.overlay_manager = OverlayManager(self.screen)
-        self.overlay_manager.set_help_text(DEFAULT_COMMANDS)
+        self.overlay_manager.set_help_text(build_help_text())
         self.overlay_manager.set_colors(DEFAULT_COLORS)
         self.overlay_manager.set_brush_sizes(DEFAULT_BRUSH_SIZES)
         
@@ -106,6 +118,21 @@ class MapMasterApp:
         self.running = False
         self.dragging_token = False
         self.pause_streaming = False
+        self._paused_surface = None  # Stream image shown while paused
+        
+        # Calls from server threads, run on the main thread between frames
+        self.command_queue = queue.Queue()
+        
+        # Held while the screen is drawn so the stream never sees a half-drawn frame
+        self.screen_lock = threading.Lock()
+        
+        # Redraw only after something changed; frame_id counts drawn frames.
+        # Small changes list their screen areas so only those are presented
+        self._dirty = True
+        self._full_redraw = True
+        self._dirty_rects = []
+        self._overlay_rects = []  # Screen areas covered by overlays last frame
+        self.frame_id = 0
         
         # Server setup
         self.server_enabled = not args.no_server
@@ -129,12 +156,7 @@ class MapMasterApp:
             
             # Update help text with server information
             ip = get_local_ip()
-            commands = self.overlay_manager.help_text.copy()
-            for i, line in enumerate(commands):
-                if "<SERVER_IP>:<PORT>" in line:
-                    commands[i] = f"Connect from mobile devices at: http://{ip}:{port}"
-                    break
-            self.overlay_manager.set_help_text(commands)
+            self.overlay_manager.set_help_text(build_help_text(ip, port))
             
             # Show initial notification
             self.overlay_manager.add_notification(f"Server running at http://{ip}:{port}", 10.0)
@@ -186,42 +208,92 @@ class MapMasterApp:
         # Remember current dimensions before switching
         current_rect = self.screen.get_rect()
         
-        # Switch mode
-        pygame.display.quit()
-        pygame.display.init()
-        self.setup_display()
-        
-        # Reinitialize components that depend on screen
-        self.overlay_manager.screen = self.screen
+        # Switch mode, keeping the stream encoder away from the screen meanwhile
+        with self.screen_lock:
+            pygame.display.quit()
+            pygame.display.init()
+            self.setup_display()
+            
+            # Reinitialize components that depend on screen
+            self.overlay_manager.set_screen(self.screen)
+            self.map_manager.set_screen(self.screen)
+            self.token_manager.set_screen(self.screen)
+        self.mark_dirty()
         
         return fullscreen
     
+    def run_on_main(self, func, *args, timeout=COMMAND_TIMEOUT):
+        """Run func(*args) on the main thread and wait for its result; raises TimeoutError if it doesn't run in time."""
+        # Nothing would pick the command up once the main loop has stopped
+        if not self.running:
+            raise TimeoutError("MapMaster is not running")
+            
+        future = Future()
+        self.command_queue.put((future, func, args))
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Don't run it later, after the caller has given up on it
+            future.cancel()
+            raise TimeoutError("MapMaster is busy, try again") from None
+    
+    def process_commands(self):
+        """Run all queued commands from other threads."""
+        ran = False
+        while True:
+            try:
+                future, func, args = self.command_queue.get_nowait()
+            except queue.Empty:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            ran = True
+            
+        # Commands may change anything on screen
+        if ran:
+            self.mark_dirty()
+    
     def handle_events(self):
         """Process events from the event queue."""
+        # Handle events in the order they happened, so clicks, releases and
+        # keys interleave correctly; a run of motion events only needs its
+        # latest position
+        repaint = False
+        pending_motion = None
         for event in pygame.event.get():
+            if event.type == pygame.MOUSEMOTION:
+                pending_motion = event
+                continue
+            if pending_motion:
+                self.handle_drag_motion(pending_motion.pos)
+                pending_motion = None
+                
             # Exit events
             if event.type == pygame.QUIT:
                 self.running = False
                 return
-            
+                
             # Keyboard events
-            if event.type == pygame.KEYDOWN:
+            elif event.type == pygame.KEYDOWN:
                 self.handle_keydown(event)
                 
             # Mouse button press
-            if event.type == pygame.MOUSEBUTTONDOWN:
+            elif event.type == pygame.MOUSEBUTTONDOWN:
                 if self.overlay_manager.handle_click(event.pos):
-                    continue  # Click handled by overlay
-                
-                if event.button == 1:  # Left click
+                    pass  # Click handled by overlay
+                elif event.button == 1:  # Left click
                     self.handle_left_mousedown(event.pos)
                 elif event.button == 3:  # Right click
                     self.handle_right_mousedown(event.pos)
                 elif event.button == 2:  # Middle click
                     self.handle_middle_mousedown(event.pos)
-            
+                    
             # Mouse button release
-            if event.type == pygame.MOUSEBUTTONUP:
+            elif event.type == pygame.MOUSEBUTTONUP:
                 if event.button == 1:  # Left click
                     if self.dragging_token:
                         self.dragging_token = False
@@ -232,16 +304,33 @@ class MapMasterApp:
                     if self.token_manager.selected_token:
                         self.token_manager.selected_token.selected = False
                         self.token_manager.selected_token = None
-            
-            # Mouse motion
-            if event.type == pygame.MOUSEMOTION:
-                self.handle_mouse_motion(event.pos)
-            
+                        
             # Window resize
-            if event.type == pygame.VIDEORESIZE:
+            elif event.type == pygame.VIDEORESIZE:
                 if not self.config.get("fullscreen", False):
                     self.config.set("window_width", event.w)
                     self.config.set("window_height", event.h)
+                    
+            # Anything else (window exposure, focus, ...) may need a repaint too
+            repaint = True
+            
+        if pending_motion:
+            self.handle_drag_motion(pending_motion.pos)
+        if repaint:
+            self.mark_dirty()
+    
+    def handle_drag_motion(self, pos):
+        """Move the dragged token, if any, repainting only the area it covered."""
+        if not self.dragging_token:
+            return
+            
+        token = self.token_manager.selected_token
+        old_rect = token.get_draw_rect() if token else None
+        self.handle_mouse_motion(pos)
+        if token:
+            self.mark_dirty(old_rect.union(token.get_draw_rect()))
+        else:
+            self.mark_dirty()
     
     def handle_keydown(self, event):
         """Handle keyboard key presses."""
@@ -296,19 +385,13 @@ class MapMasterApp:
     def handle_left_mousedown(self, pos):
         """Handle left mouse button press for token selection and movement."""
         # Check if we clicked on an existing token
-        for token in self.token_manager.tokens:
-            if token.contains_point(pos):
-                # Select this token
-                self.token_manager.selected_token = token
-                token.selected = True
-                token.start_drag(pos)
-                self.dragging_token = True
-                
-                # Deselect all other tokens
-                for other in self.token_manager.tokens:
-                    if other != token:
-                        other.selected = False
-                return
+        token = self.token_manager.get_token_at(pos)
+        if token:
+            # Select this token (deselecting the previous one) and start dragging
+            self.token_manager.select_token(token)
+            token.start_drag(pos)
+            self.dragging_token = True
+            return
         
         # If no token was clicked, show token selector to place a new token
         if self.token_manager.available_tokens:
@@ -320,26 +403,17 @@ class MapMasterApp:
     def handle_right_mousedown(self, pos):
         """Handle right mouse button press."""
         # Select or drag tokens
-        for token in self.token_manager.tokens:
-            if token.contains_point(pos):
-                # Select this token
-                self.token_manager.selected_token = token
-                token.selected = True
-                token.start_drag(pos)
-                self.dragging_token = True
-                
-                # Deselect all other tokens
-                for other in self.token_manager.tokens:
-                    if other != token:
-                        other.selected = False
-                
-                self.overlay_manager.add_notification(f"Selected {token.name}")
-                return
+        token = self.token_manager.get_token_at(pos)
+        if token:
+            self.token_manager.select_token(token)
+            token.start_drag(pos)
+            self.dragging_token = True
+            
+            self.overlay_manager.add_notification(f"Selected {token.name}")
+            return
         
         # If no token was clicked, deselect all
-        self.token_manager.selected_token = None
-        for token in self.token_manager.tokens:
-            token.selected = False
+        self.token_manager.select_token(None)
     
     def handle_middle_mousedown(self, pos):
         """Handle middle mouse button press (add token)."""
@@ -358,42 +432,72 @@ class MapMasterApp:
     
     def update(self):
         """Update game state."""
-        # Nothing to update here for now
-        pass
+        # Periodically persist annotation and settings changes
+        self.map_manager.flush_annotations()
+        self.config.flush()
+    
+    def mark_dirty(self, rect=None):
+        """Request a redraw on the next frame, of just rect if only that area changed."""
+        if rect:
+            self._dirty_rects.append(rect)
+        else:
+            self._full_redraw = True
+        self._dirty = True
     
     def draw(self):
-        """Draw all components to the screen."""
-        # Start with a clean slate
-        self.screen.fill((0, 0, 0))  # Black background
-        
-        # Draw the map
-        self.map_manager.draw_map_only()
-        
-        # Draw grid if enabled (BEFORE tokens)
-        if self.map_manager.grid_enabled:
-            self.map_manager.draw_grid()
-        
-        # Draw tokens if visible
-        if self.token_manager.tokens_visible:
-            self.token_manager.draw()
+        """Draw all components to the screen if anything changed."""
+        # Notifications expire over time, so keep drawing while any are shown
+        if not self._dirty and not self.overlay_manager.notifications:
+            return False
+        self._dirty = False
+        
+        with self.screen_lock:
+            # Start with a clean slate
+            self.screen.fill((0, 0, 0))  # Black background
+            
+            # Draw the map with its grid (BEFORE tokens)
+            self.map_manager.draw()
+            
+            # Draw tokens if visible
+            if self.token_manager.tokens_visible:
+                self.token_manager.draw()
+            
+            # Draw UI overlays; where they were last frame must be refreshed too
+            overlay_rects = self.overlay_manager.draw(current_filename=self.map_manager.get_current_filename())
+            self._dirty_rects.extend(self._overlay_rects)
+            self._dirty_rects.extend(overlay_rects)
+            self._overlay_rects = overlay_rects
         
-        # Draw UI overlays
-        self.overlay_manager.draw(current_filename=self.map_manager.get_current_filename())
+            self.frame_id += 1
         
-        # Flip the display
-        pygame.display.flip()
+        # Present only the changed areas when they are small; many or large
+        # rects cost more in per-rect overhead than a full flip
+        screen_rect = self.screen.get_rect()
+        rects = [rect.clip(screen_rect) for rect in self._dirty_rects]
+        dirty_area = sum(rect.width * rect.height for rect in rects)
+        if self._full_redraw or dirty_area >= DIRTY_AREA_FLIP_RATIO * screen_rect.width * screen_rect.height:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        self._full_redraw = False
+        self._dirty_rects = []
+        return True
     
     def run(self):
         """Run the main application loop."""
         self.running = True
         
-        # Start server if enabled
+        # Start server and its frame encoder if enabled
         if self.server_enabled and self.server_thread:
             self.server_thread.start()
+            self.server_app.frame_encoder.start()
         
         # Main loop
         clock = pygame.time.Clock()
         while self.running:
+            # Apply changes requested through the web interface
+            self.process_commands()
+            
             # Process events
             self.handle_events()
             
@@ -406,29 +510,42 @@ class MapMasterApp:
             # Cap the frame rate
             clock.tick(60)
         
+        # Fail commands queued while the loop was stopping
+        while True:
+            try:
+                future, _, _ = self.command_queue.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(TimeoutError("MapMaster is not running"))
+        
         # Clean up
         pygame.quit()
         
-        # Update config with final settings
-        self.config.save()
+        # Write out any settings changed since the last flush
+        self.config.flush(force=True)
         
         print("MapMaster closed. Thank you for using MapMaster!")
     
     def get_screen_image(self):
         """Get the current screen image for streaming."""
         if self.pause_streaming:
-            # Return a paused indicator image
-            surface = pygame.Surface(self.screen.get_size())
-            surface.fill((40, 40, 40))  # Dark gray
-            
-            font = pygame.font.SysFont('Arial', 36)
-            text = font.render("Streaming Paused", True, (255, 255, 255))
-            text_rect = text.get_rect(center=(surface.get_width() // 2, surface.get_height() // 2))
-            surface.blit(text, text_rect)
+            # Return a paused indicator image, rebuilt only when the screen size changes
+            size = self.screen.get_size()
+            if self._paused_surface is None or self._paused_surface.get_size() != size:
+                surface = pygame.Surface(size)
+                surface.fill((40, 40, 40))  # Dark gray
+                
+                text = self._big_font.render("Streaming Paused", True, (255, 255, 255))
+                text_rect = text.get_rect(center=(surface.get_width() // 2, surface.get_height() // 2))
+                surface.blit(text, text_rect)
+                self._paused_surface = surface
             
-            return surface
+            return self._paused_surface
         
-        return self.screen
+        # Hand the encoder thread a snapshot of the last complete frame
+        with self.screen_lock:
+            return self.screen.copy()
 
 
 def main():
@@ -8,7 +8,147 @@ import numpy as np
 from flask import Flask, Response, render_template, send_from_directory, request, jsonify
 import pygame
 import os
+import time
+import threading
 from ..utils.image import surface_to_bytes
+from ..utils import serialization
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
+
+# Stream encoding settings
+STREAM_FPS = 30
+JPEG_QUALITY = 80
+
+# Seconds between repeated frames while the screen doesn't change
+STREAM_KEEPALIVE = 1.0
+
+# Worker threads kept free for page and API requests when serving with
+# waitress; each stream client holds one more for as long as it watches
+API_THREADS = 4
+
+class FrameEncoder(threading.Thread):
+    """Encodes the screen to JPEG once per frame and shares it with all stream clients."""
+    
+    def __init__(self, app_instance, fps=STREAM_FPS, quality=JPEG_QUALITY):
+        super().__init__(daemon=True)
+        self.app_instance = app_instance
+        self.interval = 1.0 / fps
+        self.quality = quality
+        
+        # Players' devices don't need more than this; 0 streams at full size
+        self.max_width = app_instance.config.get("stream_max_width", 1280)
+        
+        # libjpeg-turbo's SIMD encoder, when available
+        self._turbo = None
+        if TurboJPEG:
+            try:
+                self._turbo = TurboJPEG()
+            except Exception as e:
+                print(f"Error loading libjpeg-turbo, falling back to OpenCV: {e}")
+        
+        # Latest encoded frame, guarded by the condition
+        self._cond = threading.Condition()
+        self._frame_id = 0
+        self._frame = None
+        self._source_key = None  # (app frame_id, paused) of the last encoded frame
+        self._bgr = None  # Reused BGR frame buffer for OpenCV
+    
+    def run(self):
+        """Encode frames at a steady rate until the process exits."""
+        while True:
+            started = time.monotonic()
+            try:
+                frame_bytes = self.encode_frame()
+                if frame_bytes is not None:
+                    self.publish(frame_bytes)
+            except Exception as e:
+                print(f"Error encoding stream frame: {e}")
+                
+            # Sleep off the rest of the frame period
+            remaining = self.interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+    
+    def encode_frame(self):
+        """Grab the current screen and encode it as JPEG bytes; None if unchanged."""
+        # Read the key before grabbing, so a frame drawn in between is encoded again.
+        # It is only stored once a frame is encoded, so a failed frame is retried
+        source_key = (self.app_instance.frame_id, self.app_instance.pause_streaming)
+        if source_key == self._source_key:
+            return None
+        
+        screen = self.app_instance.get_screen_image()
+        if screen is None:
+            return None
+            
+        # Encode straight from a view of the snapshot's pixels
+        if self._turbo:
+            pixels = pygame.surfarray.pixels3d(screen)
+            try:
+                frame = self.downscale(pixels.swapaxes(0, 1))
+                frame = np.ascontiguousarray(frame)
+            finally:
+                del pixels  # Release the surface lock
+            frame_bytes = self._turbo.encode(frame, quality=self.quality, pixel_format=TJPF_RGB)
+            self._source_key = source_key
+            return frame_bytes
+            
+        # Convert Pygame surface to a BGR array
+        frame = self.downscale(self.to_bgr(screen))
+        
+        # Convert to JPEG
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self._source_key = source_key
+        return buffer.tobytes()
+    
+    def to_bgr(self, screen):
+        """Convert a 32-bit surface to BGR with one SIMD pass into a reused buffer."""
+        if screen.get_bytesize() != 4:
+            self._bgr = surface_to_bytes(screen, self._bgr)
+            return self._bgr
+            
+        # View the pixel rows in place; 32-bit pixels are B, G, R, X in memory
+        # for the usual display format, or R, G, B, X when red is the low byte
+        width, height = screen.get_size()
+        code = cv2.COLOR_RGBA2BGR if screen.get_shifts()[0] == 0 else cv2.COLOR_BGRA2BGR
+        if self._bgr is None or self._bgr.shape[:2] != (height, width):
+            self._bgr = np.empty((height, width, 3), dtype=np.uint8)
+            
+        buffer = screen.get_buffer()
+        rows = np.frombuffer(buffer, dtype=np.uint8).reshape(height, screen.get_pitch())
+        cv2.cvtColor(rows[:, :width * 4].reshape(height, width, 4), code, dst=self._bgr)
+        del rows, buffer  # Release the surface lock
+        return self._bgr
+    
+    def downscale(self, frame):
+        """Shrink a (height, width, 3) frame to the configured stream width."""
+        width = frame.shape[1]
+        if not self.max_width or width <= self.max_width:
+            return frame
+            
+        scale = self.max_width / width
+        return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    def publish(self, frame_bytes):
+        """Make a new frame available and wake all waiting clients."""
+        with self._cond:
+            self._frame = frame_bytes
+            self._frame_id += 1
+            self._cond.notify_all()
+    
+    def wait_frame(self, last_id, timeout=None):
+        """Wait for a frame newer than last_id; returns (frame_id, frame_bytes)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame_id != last_id, timeout)
+            return self._frame_id, self._frame
 
 def create_app(app_instance):
     """Create the Flask application."""
@@ -19,6 +159,21 @@ def create_app(app_instance):
     # Store a reference to the main application
     flask_app.app_instance = app_instance
     
+    # Token image listing as (directory mtime, JSON bytes)
+    flask_app.tokens_cache = (None, None)
+    
+    # One encoder serves every stream client; started by the application
+    flask_app.frame_encoder = FrameEncoder(app_instance)
+    
+    # Streams beyond this are turned away, so they can't take up every worker
+    flask_app.max_stream_clients = app_instance.config.get("max_stream_clients", 32)
+    flask_app.stream_slots = threading.BoundedSemaphore(flask_app.max_stream_clients)
+    
+    @flask_app.errorhandler(TimeoutError)
+    def main_loop_unavailable(e):
+        """Report API calls the main loop couldn't run in time."""
+        return jsonify({'success': False, 'error': str(e)}), 503
+    
     # Define routes
     @flask_app.route('/')
     def index():
@@ -33,8 +188,13 @@ def create_app(app_instance):
     @flask_app.route('/stream')
     def stream():
         """Stream the current screen."""
-        return Response(generate_frames(flask_app.app_instance),
-                       mimetype='multipart/x-mixed-replace; boundary=frame')
+        if not flask_app.stream_slots.acquire(blocking=False):
+            return "Too many stream clients", 503
+            
+        response = Response(generate_frames(flask_app.frame_encoder),
+                            mimetype='multipart/x-mixed-replace; boundary=frame')
+        response.call_on_close(flask_app.stream_slots.release)
+        return response
     
     @flask_app.route('/static/<path:filename>')
     def serve_static(filename):
@@ -45,10 +205,22 @@ def create_app(app_instance):
     def get_tokens():
         """Get a list of available tokens."""
         token_manager = flask_app.app_instance.token_manager
-        token_manager.refresh_token_list()
         
+        # Serve the cached listing until the tokens directory changes
+        try:
+            mtime = os.stat(token_manager.tokens_directory).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is not None and flask_app.tokens_cache[0] == mtime:
+            return Response(flask_app.tokens_cache[1], mimetype='application/json')
+            
+        def refresh_tokens():
+            token_manager.refresh_token_list()
+            return token_manager.available_tokens
+            
+        # Refresh the token list on the main thread, between frames
         tokens = []
-        for path in token_manager.available_tokens:
+        for path in flask_app.app_instance.run_on_main(refresh_tokens):
             name = os.path.splitext(os.path.basename(path))[0]
             tokens.append({
                 'name': name,
@@ -56,23 +228,28 @@ def create_app(app_instance):
                 'url': f'/api/token_image?path={path}'
             })
             
-        return jsonify({'tokens': tokens})
+        payload = serialization.dumps({'tokens': tokens})
+        flask_app.tokens_cache = (mtime, payload)
+        return Response(payload, mimetype='application/json')
     
     @flask_app.route('/api/active_tokens', methods=['GET'])
     def get_active_tokens():
         """Get a list of tokens currently on the map."""
         token_manager = flask_app.app_instance.token_manager
         
-        tokens = []
-        for token in token_manager.tokens:
-            tokens.append({
-                'name': token.name,
-                'position': token.position,
-                'size': token.size,
-                'visible': token.visible
-            })
+        def list_tokens():
+            tokens = []
+            for token in token_manager.tokens:
+                tokens.append({
+                    'name': token.name,
+                    'position': token.position,
+                    'size': token.size,
+                    'visible': token.visible
+                })
+            return tokens
             
-        return jsonify({'tokens': tokens})
+        # Read the token list on the main thread, between frames
+        return jsonify({'tokens': flask_app.app_instance.run_on_main(list_tokens)})
     
     @flask_app.route('/api/add_token', methods=['POST'])
     def add_token():
@@ -82,7 +259,7 @@ def create_app(app_instance):
         position = data.get('position', [400, 300])  # Default to center
         
         token_manager = flask_app.app_instance.token_manager
-        token = token_manager.add_token(token_path, position)
+        token = flask_app.app_instance.run_on_main(token_manager.add_token, token_path, position)
         
         if token:
             return jsonify({'success': True, 'token': {
@@ -104,15 +281,15 @@ def create_app(app_instance):
         
         token_manager = flask_app.app_instance.token_manager
         
-        # Find token by name
-        found = False
-        for token in token_manager.tokens:
-            if token.name == token_name:
-                token.set_position(position)
-                found = True
-                break
+        def move():
+            # Find token by name
+            for token in token_manager.tokens:
+                if token.name == token_name:
+                    token.set_position(position)
+                    return True
+            return False
         
-        if found:
+        if flask_app.app_instance.run_on_main(move):
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'Token not found'})
@@ -128,11 +305,15 @@ def create_app(app_instance):
         
         token_manager = flask_app.app_instance.token_manager
         
-        # Find token by name
-        for token in token_manager.tokens:
-            if token.name == token_name:
-                token_manager.remove_token(token)
-                return jsonify({'success': True})
+        def remove():
+            # Find token by name
+            for token in token_manager.tokens:
+                if token.name == token_name:
+                    return token_manager.remove_token(token)
+            return False
+        
+        if flask_app.app_instance.run_on_main(remove):
+            return jsonify({'success': True})
         
         return jsonify({'success': False, 'error': 'Token not found'})
     
@@ -149,50 +330,53 @@ def create_app(app_instance):
     def next_map():
         """Switch to the next map."""
         map_manager = flask_app.app_instance.map_manager
-        success = map_manager.next_map()
+        success = flask_app.app_instance.run_on_main(map_manager.next_map)
         return jsonify({'success': success})
 
     @flask_app.route('/api/prev_map', methods=['POST'])
     def prev_map():
         """Switch to the previous map."""
         map_manager = flask_app.app_instance.map_manager
-        success = map_manager.previous_map()
+        success = flask_app.app_instance.run_on_main(map_manager.previous_map)
         return jsonify({'success': success})
 
     @flask_app.route('/api/toggle_grid', methods=['POST'])
     def toggle_grid():
         """Toggle the grid overlay."""
         map_manager = flask_app.app_instance.map_manager
-        enabled = map_manager.toggle_grid()
+        enabled = flask_app.app_instance.run_on_main(map_manager.toggle_grid)
         return jsonify({'success': True, 'grid_enabled': enabled})
 
     @flask_app.route('/api/toggle_fullscreen', methods=['POST'])
     def toggle_fullscreen():
         """Toggle fullscreen mode."""
-        success = flask_app.app_instance.toggle_fullscreen()
+        success = flask_app.app_instance.run_on_main(flask_app.app_instance.toggle_fullscreen)
         return jsonify({'success': True, 'fullscreen': success})
 
     return flask_app
 
-def generate_frames(app_instance):
+def generate_frames(frame_encoder):
     """Generate video frames for streaming."""
+    last_id = 0
     while True:
-        # Get the current screen from the application
-        screen = app_instance.get_screen_image()
-        if screen is None:
+        # Wait for the shared encoder to publish a new frame; while the
+        # screen is static, resend the last one now and then as a keepalive
+        last_id, frame_bytes = frame_encoder.wait_frame(last_id, STREAM_KEEPALIVE)
+        if frame_bytes is None:
             continue
-            
-        # Convert Pygame surface to bytes
-        frame = surface_to_bytes(screen)
-        
-        # Convert to JPEG
-        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        frame_bytes = buffer.tobytes()
         
         # Yield the frame in the MJPEG format
         yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+               b'Content-Type: image/jpeg\r\n'
+               b'Content-Length: ' + str(len(frame_bytes)).encode() + b'\r\n\r\n' + frame_bytes + b'\r\n')
 
 def start_server(app, host, port):
     """Start the Flask server."""
-    app.run(host=host, port=port, threaded=True)
\ No newline at end of file
+    # Prefer waitress: each stream client gets its own worker and writes
+    # go straight out, so a slow client cannot hold up the others. The pool
+    # has a worker for every allowed stream plus some for everything else
+    if serve:
+        threads = app.max_stream_clients + API_THREADS
+        serve(app, host=host, port=port, threads=threads, send_bytes=1, channel_timeout=30)
+    else:
+        app.run(host=host, port=port, threaded=True)
\ No newline at end of file
@@ -4,8 +4,15 @@ Handles UI overlays like command help, color selection, and notifications.
 """
 
 import pygame
+import pygame.freetype
 import time
 import os
+from collections import deque
+from ..utils.image import load_image, blit_sequence, clip_to_circle
+
+# Upper bounds for the rendered text and background caches
+TEXT_CACHE_SIZE = 256
+BACKGROUND_CACHE_SIZE = 32
 
 class OverlayManager:
     """
@@ -16,15 +23,18 @@ class OverlayManager:
     def __init__(self, screen):
         """Initialize the overlay manager."""
         self.screen = screen
-        self.font = pygame.font.SysFont('Arial', 18)
-        self.heading_font = pygame.font.SysFont('Arial', 22, bold=True)
+        if not pygame.freetype.get_init():
+            pygame.freetype.init()
+        self.font = pygame.freetype.SysFont('Arial', 18)
+        self.heading_font = pygame.freetype.SysFont('Arial', 22, bold=True)
+        self.font.pad = self.heading_font.pad = True  # Line heights independent of the glyphs used
         
         # State variables
         self.show_help = False
         self.show_color_selector = False
         self.show_token_selector = False
         self.show_filename = True
-        self.notifications = []  # List of (text, expiry_time) tuples
+        self.notifications = deque()  # (text, monotonic expiry_time) tuples, oldest first
         
         # Colors
         self.overlay_bg_color = (30, 30, 30, 180)  # Dark semi-transparent background
@@ -41,19 +51,75 @@ class OverlayManager:
         self.colors = {}
         self.brush_sizes = {}
         
+        # Circular token thumbnails by (path, size), kept for as long as
+        # the token list they were built for
+        self._token_surface_cache = {}
+        self._thumbnail_tokens = None
+        
+        # Token selector layout, rebuilt when the token list or screen size changes
+        self._token_layout = None
+        self._token_layout_tokens = None
+        self._token_layout_size = None
+        
+        # Rendered text by (text, font, color) and overlay backgrounds by size
+        self._text_cache = {}
+        self._size_cache = {}  # Measured text sizes by (font, text)
+        self._background_cache = {}
+        
+        # Help and color selector overlays rendered whole, with what they were rendered for
+        self._help_surface = None
+        self._help_key = None
+        self._color_selector_surface = None
+        self._color_selector_key = None
+        
+        # Pre-rendered color swatches and brush previews, by name
+        self._swatch_surfaces = {}
+        self._brush_surfaces = {}
+        
+    def set_screen(self, screen):
+        """Update the screen reference and drop surfaces built for the old display."""
+        self.screen = screen
+        self._token_surface_cache.clear()
+        self._thumbnail_tokens = None
+        self._token_layout = None
+        self._background_cache.clear()
+        self._help_surface = None
+        self._color_selector_surface = None
+        
     def set_help_text(self, help_text):
         """Set the help text to display when help overlay is shown."""
         self.help_text = help_text if isinstance(help_text, list) else [help_text]
+        self._text_cache.clear()
+        self._size_cache.clear()
+        self._help_surface = None
     
     def set_colors(self, colors):
         """Set available annotation colors."""
         self.colors = colors
+        self._text_cache.clear()
+        self._size_cache.clear()
+        self._color_selector_surface = None
+        self._swatch_surfaces = {}
+        for name, color in colors.items():
+            swatch = pygame.Surface((30, 20))
+            swatch.fill(color)
+            pygame.draw.rect(swatch, (255, 255, 255), swatch.get_rect(), 1)  # White border
+            self._swatch_surfaces[name] = swatch
         if not self.current_color and colors:
             self.current_color = list(colors.keys())[0]
     
     def set_brush_sizes(self, brush_sizes):
         """Set available brush sizes."""
         self.brush_sizes = brush_sizes
+        self._text_cache.clear()
+        self._size_cache.clear()
+        self._color_selector_surface = None
+        self._brush_surfaces = {}
+        for name, size in brush_sizes.items():
+            radius = size // 2
+            brush = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+            pygame.draw.circle(brush, (255, 255, 255), (radius, radius), radius)
+            self._brush_surfaces[name] = brush
         if not self.current_brush_size and brush_sizes:
             self.current_brush_size = list(brush_sizes.keys())[0]
     
@@ -81,7 +147,7 @@ class OverlayManager:
     
     def add_notification(self, text, duration=3.0):
         """Add a temporary notification to display."""
-        self.notifications.append((text, time.time() + duration))
+        self.notifications.append((text, time.monotonic() + duration))
     
     def select_color(self, color_name):
         """Select a color by name."""
@@ -103,70 +169,141 @@ class OverlayManager:
         """Get the current selected brush size value."""
         return self.brush_sizes.get(self.current_brush_size, 1)
     
-    def _draw_text_block(self, text_lines, x, y, width=None, height=None, max_height=None):
-        """Draw a block of text with a semi-transparent background."""
-        if not text_lines:
-            return y
-        
-        # Calculate text block dimensions if not provided
-        if width is None or height is None:
-            line_heights = [self.font.size(line)[1] for line in text_lines]
-            text_width = max(self.font.size(line)[0] for line in text_lines)
-            text_height = sum(line_heights)
+    def _render(self, text, font, color):
+        """Render text, reusing the surface from earlier frames."""
+        key = (text, font, color)
+        surface = self._text_cache.get(key)
+        if surface is None:
+            # Notifications and filenames keep adding new strings
+            if len(self._text_cache) >= TEXT_CACHE_SIZE:
+                self._text_cache.clear()
+            surface, _ = font.render(text, color)
+            self._text_cache[key] = surface
+        return surface
+    
+    def _size(self, font, text):
+        """Measure text, reusing the size from earlier frames."""
+        key = (font, text)
+        size = self._size_cache.get(key)
+        if size is None:
+            if len(self._size_cache) >= TEXT_CACHE_SIZE:
+                self._size_cache.clear()
+            size = (font.get_rect(text).width, font.get_sized_height())
+            self._size_cache[key] = size
+        return size
+    
+    def _get_background(self, width, height):
+        """Get a semi-transparent overlay background of the given size."""
+        surface = self._background_cache.get((width, height))
+        if surface is None:
+            if len(self._background_cache) >= BACKGROUND_CACHE_SIZE:
+                self._background_cache.clear()
+            # An opaque surface with surface alpha blends much faster than per-pixel alpha
+            *color, alpha = self.overlay_bg_color
+            surface = pygame.Surface((width, height)).convert()
+            surface.fill(color)
+            surface.set_alpha(alpha)
+            self._background_cache[(width, height)] = surface
+        return surface
+    
+    def _get_token_thumbnail(self, token_path, size):
+        """Get the circular, bordered selector thumbnail for a token image."""
+        # Start over whenever the token list is refreshed
+        available_tokens = self.token_manager.available_tokens
+        if available_tokens is not self._thumbnail_tokens:
+            self._token_surface_cache.clear()
+            self._thumbnail_tokens = available_tokens
+            
+        key = (token_path, size)
+        circular_img = self._token_surface_cache.get(key)
+        if circular_img is not None:
+            return circular_img
             
-            width = width or text_width + 20  # Add padding
-            height = height or text_height + 20  # Add padding
+        center = (size // 2, size // 2)
+        try:
+            token_img = load_image(token_path)
+            if not token_img.get_flags() & pygame.SRCALPHA:
+                token_img = token_img.convert_alpha()  # load_image's fallback is opaque
+            circular_img = pygame.transform.smoothscale(token_img, (size, size))
+            
+            # Apply circular mask
+            clip_to_circle(circular_img)
+            
+            # Draw border
+            pygame.draw.circle(circular_img, (200, 200, 200), center, size // 2, 1)
+        except Exception as e:
+            print(f"Error loading token thumbnail {token_path}: {e}")
+            # If image loading fails, draw a placeholder circular token
+            circular_img = pygame.Surface((size, size), pygame.SRCALPHA)
+            pygame.draw.circle(circular_img, (150, 50, 50), center, size // 2)
+            pygame.draw.circle(circular_img, (255, 255, 255), center, size // 2, 1)
+            
+        self._token_surface_cache[key] = circular_img
+        return circular_img
+    
+    def _render_text_block(self, text_lines, width=None, max_height=None, min_height=None):
+        """Render a block of text over a semi-transparent background into one surface."""
+        # Pick each line's font, as headings are drawn larger
+        styled_lines = []
+        for line in text_lines:
+            if line.startswith("==") and line.endswith("=="):
+                # Section heading - use heading font
+                styled_lines.append((self.heading_font, self.highlight_color, line.strip("=")))
+            else:
+                # Normal text
+                styled_lines.append((self.font, self.text_color, line))
+        
+        # Calculate text block dimensions from the same line advance used when drawing
+        sizes = [self._size(font, line) for font, _, line in styled_lines]
+        width = width or max(w for w, _ in sizes) + 20  # Add padding
+        height = sum(h + 2 for _, h in sizes) + 20  # Add padding
+        if min_height:
+            height = max(height, min_height)
         
         # Check if we need to cap the height
         if max_height and height > max_height:
             height = max_height
         
-        # Create a transparent surface for the background
-        bg_surface = pygame.Surface((width, height), pygame.SRCALPHA)
-        bg_surface.fill(self.overlay_bg_color)
-        self.screen.blit(bg_surface, (x, y))
+        block = pygame.Surface((width, height), pygame.SRCALPHA)
+        block.fill(self.overlay_bg_color)
         
-        # Draw text
-        text_y = y + 10  # Start with some padding
-        for line in text_lines:
-            if line.startswith("==") and line.endswith("=="):
-                # Section heading - use heading font
-                text_surface = self.heading_font.render(line.strip("="), True, self.highlight_color)
-            else:
-                # Normal text
-                text_surface = self.font.render(line, True, self.text_color)
-                
-            self.screen.blit(text_surface, (x + 10, text_y))
-            text_y += text_surface.get_height() + 2
+        # Draw text straight into the block
+        text_y = 10  # Start with some padding
+        for (font, color, line), (_, line_height) in zip(styled_lines, sizes):
+            if line:
+                font.render_to(block, (10, text_y), line, color)
+            text_y += line_height + 2
             
             # Check if we've exceeded the max height
-            if max_height and (text_y - y) > max_height - 10:
+            if max_height and text_y > max_height - 10:
                 break
         
-        return text_y + 10  # Return the Y position after the text block
+        return block
     
     def draw_help_overlay(self):
         """Draw the help overlay."""
         if not self.show_help or not self.help_text:
-            return
+            return None
             
         screen_width, screen_height = self.screen.get_size()
         overlay_width = min(400, screen_width - 40)
+        max_height = screen_height - 80
+        
+        # Render the help text once per screen size
+        key = (overlay_width, max_height)
+        if self._help_surface is None or self._help_key != key:
+            self._help_surface = self._render_text_block(self.help_text, width=overlay_width, max_height=max_height)
+            self._help_key = key
         
         # Center the overlay
         x = (screen_width - overlay_width) // 2
         y = 40
         
         # Draw the help text
-        self._draw_text_block(self.help_text, x, y, width=overlay_width, max_height=screen_height - 80)
+        return self.screen.blit(self._help_surface, (x, y))
     
-    def draw_color_selector(self):
-        """Draw the color and brush size selector overlay."""
-        if not self.show_color_selector:
-            return
-        
-        screen_width = self.screen.get_size()[0]
-        
+    def _render_color_selector(self):
+        """Render the color and brush size selector, with the current selections highlighted."""
         # Prepare content
         title = ["== Color and Brush Selection ==", ""]
         color_lines = [f"Color: {name}" for name in self.colors.keys()]
@@ -176,62 +313,66 @@ class OverlayManager:
         
         # Calculate dimensions
         overlay_width = 250
-        x = (screen_width - overlay_width) // 2
-        y = 40
+        swatch_y = 50  # Position after title
+        brush_y = swatch_y + len(self.colors) * 25 + 50  # Position after colors and sub-header
         
-        # Draw background
-        self._draw_text_block(all_lines, x, y, width=overlay_width)
-        
-        # Draw color swatches
-        swatch_y = y + 50  # Position after title
-        for i, (name, color) in enumerate(self.colors.items()):
-            # Draw color swatch
-            swatch_rect = pygame.Rect(x + 160, swatch_y + i * 25, 30, 20)
-            pygame.draw.rect(self.screen, color, swatch_rect)
-            pygame.draw.rect(self.screen, (255, 255, 255), swatch_rect, 1)  # White border
-            
-            # Highlight selected color
+        # Draw background, tall enough for the last brush size row
+        selector = self._render_text_block(all_lines, width=overlay_width,
+                                           min_height=brush_y + len(self.brush_sizes) * 25 + 20)
+        
+        # Draw color swatches and brush size indicators in one call
+        blits = [
+            (self._swatch_surfaces[name], (160, swatch_y + i * 25))
+            for i, name in enumerate(self.colors)
+        ]
+        for i, name in enumerate(self.brush_sizes):
+            brush = self._brush_surfaces[name]
+            blits.append((brush, brush.get_rect(center=(175, brush_y + i * 25 + 10))))
+        blit_sequence(selector, blits)
+        
+        # Highlight selected color
+        highlight_color = self.selected_bg_color[:3]  # Opaque, as when drawn on the screen
+        for i, name in enumerate(self.colors):
             if name == self.current_color:
-                highlight_rect = pygame.Rect(x + 10, swatch_y + i * 25 - 2, overlay_width - 20, 24)
-                pygame.draw.rect(self.screen, self.selected_bg_color, highlight_rect)
-                text = self.font.render(f"Color: {name}", True, self.highlight_color)
-                self.screen.blit(text, (x + 20, swatch_y + i * 25))
+                highlight_rect = pygame.Rect(10, swatch_y + i * 25 - 2, overlay_width - 20, 24)
+                pygame.draw.rect(selector, highlight_color, highlight_rect)
+                self.font.render_to(selector, (20, swatch_y + i * 25), f"Color: {name}", self.highlight_color)
         
-        # Draw brush size indicators
-        brush_y = swatch_y + len(self.colors) * 25 + 50  # Position after colors and sub-header
-        for i, (name, size) in enumerate(self.brush_sizes.items()):
-            # Draw brush size indicator
-            center_x = x + 175
-            center_y = brush_y + i * 25 + 10
-            pygame.draw.circle(self.screen, (255, 255, 255), (center_x, center_y), size // 2)
-            
-            # Highlight selected brush size
+        # Highlight selected brush size
+        for i, name in enumerate(self.brush_sizes):
             if name == self.current_brush_size:
-                highlight_rect = pygame.Rect(x + 10, brush_y + i * 25 - 2, overlay_width - 20, 24)
-                pygame.draw.rect(self.screen, self.selected_bg_color, highlight_rect)
-                text = self.font.render(f"Size: {name}", True, self.highlight_color)
-                self.screen.blit(text, (x + 20, brush_y + i * 25))
-
-    def draw_token_selector(self):
-        """Draw the token selector overlay."""
-        if not self.show_token_selector or not hasattr(self, 'token_manager'):
-            return
-            
-        screen_width, screen_height = self.screen.get_size()
+                highlight_rect = pygame.Rect(10, brush_y + i * 25 - 2, overlay_width - 20, 24)
+                pygame.draw.rect(selector, highlight_color, highlight_rect)
+                self.font.render_to(selector, (20, brush_y + i * 25), f"Size: {name}", self.highlight_color)
+                
+        return selector
+    
+    def draw_color_selector(self):
+        """Draw the color and brush size selector overlay."""
+        if not self.show_color_selector:
+            return None
         
-        # Get available tokens
-        available_tokens = self.token_manager.available_tokens
+        # Re-render only when the selection changes
+        key = (self.current_color, self.current_brush_size)
+        if self._color_selector_surface is None or self._color_selector_key != key:
+            self._color_selector_surface = self._render_color_selector()
+            self._color_selector_key = key
         
-        if not available_tokens:
-            self.show_token_selector = False
-            return
-            
-        # Store click position if not already set
-        if not hasattr(self, 'token_click_pos'):
-            self.token_click_pos = None
+        screen_width = self.screen.get_size()[0]
+        x = (screen_width - self._color_selector_surface.get_width()) // 2
+        y = 40
         
-        # Prepare content
-        title = ["== Select Token ==", ""]
+        return self.screen.blit(self._color_selector_surface, (x, y))
+    
+    def _get_token_layout(self):
+        """Get the token selector's (overlay rect, close button rect, [(token path, rect)]) layout."""
+        available_tokens = self.token_manager.available_tokens
+        screen_size = self.screen.get_size()
+        if (self._token_layout is not None and self._token_layout_tokens is available_tokens
+                and self._token_layout_size == screen_size):
+            return self._token_layout
+            
+        screen_width, screen_height = screen_size
         
         # Calculate dimensions
         overlay_width = 300
@@ -249,134 +390,139 @@ class OverlayManager:
         # Center the overlay
         x = (screen_width - overlay_width) // 2
         y = (screen_height - overlay_height) // 2
+        overlay_rect = pygame.Rect(x, y, overlay_width, overlay_height)
         
-        # Draw background
-        bg_surface = pygame.Surface((overlay_width, overlay_height), pygame.SRCALPHA)
-        bg_surface.fill(self.overlay_bg_color)
-        self.screen.blit(bg_surface, (x, y))
-        
-        # Draw title
-        title_surface = self.heading_font.render(title[0], True, self.highlight_color)
-        self.screen.blit(title_surface, (x + (overlay_width - title_surface.get_width()) // 2, y + 10))
-        
-        # Draw token grid
-        token_y = y + 50  # Start after title
+        # Token grid, starting after the title
+        token_y = y + 50
         token_x = x + padding
-        
+        token_rects = []
         for i, token_path in enumerate(available_tokens):
-            # Calculate position in grid
             row = i // tokens_per_row
             col = i % tokens_per_row
+            token_rects.append((token_path, pygame.Rect(
+                token_x + col * (token_display_size + padding),
+                token_y + row * (token_display_size + padding),
+                token_display_size, token_display_size
+            )))
+            
+        # Close button below all tokens
+        close_width = self._size(self.font, "Close")[0] + 20
+        close_rect = pygame.Rect(
+            x + (overlay_width - close_width) // 2, 
+            y + 60 + tokens_height,
+            close_width, 25
+        )
+        
+        self._token_layout = (overlay_rect, close_rect, token_rects)
+        self._token_layout_tokens = available_tokens
+        self._token_layout_size = screen_size
+        return self._token_layout
+    
+    def draw_token_selector(self):
+        """Draw the token selector overlay."""
+        if not self.show_token_selector or not hasattr(self, 'token_manager'):
+            return None
             
-            token_pos_x = token_x + col * (token_display_size + padding)
-            token_pos_y = token_y + row * (token_display_size + padding)
+        if not self.token_manager.available_tokens:
+            self.show_token_selector = False
+            return None
             
+        # Store click position if not already set
+        if not hasattr(self, 'token_click_pos'):
+            self.token_click_pos = None
+        
+        overlay_rect, close_rect, token_rects = self._get_token_layout()
+        
+        # Draw background
+        self.screen.blit(self._get_background(overlay_rect.width, overlay_rect.height), overlay_rect)
+        
+        # Draw title
+        title_surface = self._render("== Select Token ==", self.heading_font, self.highlight_color)
+        self.screen.blit(title_surface, (overlay_rect.centerx - title_surface.get_width() // 2, overlay_rect.y + 10))
+        
+        # Draw token grid
+        blits = []
+        for token_path, rect in token_rects:
             # Extract token name for display
             token_name = os.path.splitext(os.path.basename(token_path))[0]
             
-            # Try to load and display token image
-            try:
-                token_img = pygame.image.load(token_path)
-                token_img = pygame.transform.smoothscale(token_img, (token_display_size, token_display_size))
-                
-                # Create circular mask
-                mask = pygame.Surface((token_display_size, token_display_size), pygame.SRCALPHA)
-                pygame.draw.circle(mask, (255, 255, 255, 255), 
-                                 (token_display_size // 2, token_display_size // 2), 
-                                 token_display_size // 2)
-                
-                # Apply mask
-                circular_img = pygame.Surface((token_display_size, token_display_size), pygame.SRCALPHA)
-                circular_img.blit(token_img, (0, 0))
-                circular_img.blit(mask, (0, 0), special_flags=pygame.BLEND_RGBA_MIN)
-                
-                self.screen.blit(circular_img, (token_pos_x, token_pos_y))
-                
-                # Draw border
-                pygame.draw.circle(self.screen, (200, 200, 200), 
-                                 (token_pos_x + token_display_size // 2, token_pos_y + token_display_size // 2),
-                                 token_display_size // 2, 1)
-            except:
-                # If image loading fails, draw a placeholder circular token
-                pygame.draw.circle(self.screen, (150, 50, 50),
-                                 (token_pos_x + token_display_size // 2, token_pos_y + token_display_size // 2),
-                                 token_display_size // 2)
-                pygame.draw.circle(self.screen, (255, 255, 255),
-                                 (token_pos_x + token_display_size // 2, token_pos_y + token_display_size // 2),
-                                 token_display_size // 2, 1)
-            
-            # Draw token name below the image
-            name_surface = self.font.render(token_name[:10], True, self.text_color)
-            name_x = token_pos_x + (token_display_size - name_surface.get_width()) // 2
-            self.screen.blit(name_surface, (name_x, token_pos_y + token_display_size + 2))
-        
-        # Calculate position for close button (below all tokens)
-        close_button_y = y + 60 + tokens_height
+            # Token image, then its name below it
+            circular_img = self._get_token_thumbnail(token_path, rect.width)
+            blits.append((circular_img, rect))
+            name_surface = self._render(token_name[:10], self.font, self.text_color)
+            name_x = rect.centerx - name_surface.get_width() // 2
+            blits.append((name_surface, (name_x, rect.bottom + 2)))
+        blit_sequence(self.screen, blits)
         
         # Draw close button
-        close_text = self.font.render("Close", True, self.text_color)
-        close_width = close_text.get_width() + 20
-        close_rect = pygame.Rect(
-            x + (overlay_width - close_width) // 2, 
-            close_button_y,
-            close_width, 25
-        )
+        close_text = self._render("Close", self.font, self.text_color)
         pygame.draw.rect(self.screen, (80, 80, 80), close_rect)
         pygame.draw.rect(self.screen, (200, 200, 200), close_rect, 1)
         self.screen.blit(close_text, (close_rect.x + 10, close_rect.y + 5))
+        
+        return overlay_rect
     
     def draw_notifications(self):
         """Draw any active notifications."""
-        current_time = time.time()
-        active_notifications = []
+        current_time = time.monotonic()
         
-        for text, expiry_time in self.notifications:
-            if current_time < expiry_time:
-                active_notifications.append((text, expiry_time))
-        
-        # Update the notifications list to only include active ones
-        self.notifications = active_notifications
+        # Drop expired notifications from the front; one that outlives a
+        # later, shorter one is skipped below until it reaches the front
+        while self.notifications and self.notifications[0][1] <= current_time:
+            self.notifications.popleft()
+            
+        # Show at most 3 notifications, newest at the bottom
+        active_notifications = []
+        for text, expiry_time in reversed(self.notifications):
+            if expiry_time > current_time:
+                active_notifications.append(text)
+                if len(active_notifications) == 3:
+                    break
         
         if not active_notifications:
-            return
+            return None
             
         # Draw notifications at the bottom of the screen
         screen_width, screen_height = self.screen.get_size()
         notification_y = screen_height - 40
         
-        for text, _ in reversed(active_notifications[-3:]):  # Show at most 3 notifications
-            text_surface = self.font.render(text, True, self.text_color)
+        blits = []
+        rects = []
+        for text in active_notifications:
+            text_surface = self._render(text, self.font, self.text_color)
             notification_width = text_surface.get_width() + 20
             
-            # Draw background
-            bg_surface = pygame.Surface((notification_width, 30), pygame.SRCALPHA)
-            bg_surface.fill(self.overlay_bg_color)
-            self.screen.blit(bg_surface, ((screen_width - notification_width) // 2, notification_y - 30))
-            
-            # Draw text
-            self.screen.blit(text_surface, ((screen_width - text_surface.get_width()) // 2, notification_y - 25))
+            # Background, then text
+            bg_surface = self._get_background(notification_width, 30)
+            bg_pos = ((screen_width - notification_width) // 2, notification_y - 30)
+            blits.append((bg_surface, bg_pos))
+            rects.append(bg_surface.get_rect(topleft=bg_pos))
+            blits.append((text_surface, ((screen_width - text_surface.get_width()) // 2, notification_y - 25)))
             notification_y -= 35
+        blit_sequence(self.screen, blits)
+        
+        return rects[0].unionall(rects[1:])
     
     def draw_filename(self, filename):
         """Draw the current filename if enabled."""
         if not self.show_filename or not filename:
-            return
+            return None
             
         screen_width, screen_height = self.screen.get_size()
         
         # Extract the base filename without path
-        base_filename = filename.split('/')[-1]
+        base_filename = os.path.basename(filename)
         
-        text_surface = self.font.render(base_filename, True, self.text_color)
+        text_surface = self._render(base_filename, self.font, self.text_color)
         text_width = text_surface.get_width() + 20
         
         # Draw background
-        bg_surface = pygame.Surface((text_width, 30), pygame.SRCALPHA)
-        bg_surface.fill(self.overlay_bg_color)
-        self.screen.blit(bg_surface, (10, 10))
+        self.screen.blit(self._get_background(text_width, 30), (10, 10))
         
         # Draw text
         self.screen.blit(text_surface, (20, 15))
+        
+        return pygame.Rect(10, 10, text_width, 30)
     
     def handle_click(self, pos):
         """Handle mouse clicks on overlays and return True if handled."""
@@ -417,54 +563,27 @@ class OverlayManager:
         
         # Handle token selector clicks
         if self.show_token_selector and hasattr(self, 'token_manager'):
-            # Calculate positions (must match those in draw_token_selector)
-            screen_width, screen_height = self.screen.get_size()
-            overlay_width = 300
-            token_display_size = 50
-            padding = 10
-            tokens_per_row = 4
+            # Same layout as drawn by draw_token_selector
+            overlay_rect, close_rect, token_rects = self._get_token_layout()
             
-            available_tokens = self.token_manager.available_tokens
-            num_rows = (len(available_tokens) + tokens_per_row - 1) // tokens_per_row
-            tokens_height = (token_display_size + padding) * num_rows + token_display_size // 2
-            
-            # Add extra space for close button
-            overlay_height = 60 + tokens_height + 40
-            
-            # Overlay position
-            overlay_x = (screen_width - overlay_width) // 2
-            overlay_y = (screen_height - overlay_height) // 2
+            # Click outside closes the selector
+            if not overlay_rect.collidepoint(x, y):
+                self.show_token_selector = False
+                return True
             
             # Close button click?
-            close_button_y = overlay_y + 60 + tokens_height
-            close_width = 80
-            close_rect = pygame.Rect(
-                overlay_x + (overlay_width - close_width) // 2, 
-                close_button_y,
-                close_width, 25
-            )
             if close_rect.collidepoint(x, y):
                 self.show_token_selector = False
                 return True
             
             # Check if clicked on a token
-            token_y = overlay_y + 50
-            token_x = overlay_x + padding
-            
-            for i, token_path in enumerate(available_tokens):
-                # Calculate position in grid
-                row = i // tokens_per_row
-                col = i % tokens_per_row
-                
-                token_pos_x = token_x + col * (token_display_size + padding)
-                token_pos_y = token_y + row * (token_display_size + padding)
-                
+            for token_path, rect in token_rects:
+                if not rect.collidepoint(x, y):
+                    continue
+                    
                 # Using a circular hit detection
-                center_x = token_pos_x + token_display_size // 2
-                center_y = token_pos_y + token_display_size // 2
-                dist_squared = (x - center_x)**2 + (y - center_y)**2
-                
-                if dist_squared <= (token_display_size // 2)**2:
+                radius = rect.width // 2
+                if (x - rect.centerx)**2 + (y - rect.centery)**2 <= radius**2:
                     # Selected this token - place it at the stored click position
                     placement_pos = self.token_click_pos if self.token_click_pos else pygame.mouse.get_pos()
                     self.token_manager.add_token(token_path, placement_pos)
@@ -472,12 +591,6 @@ class OverlayManager:
                     self.show_token_selector = False
                     return True
             
-            # Click outside closes the selector
-            overlay_rect = pygame.Rect(overlay_x, overlay_y, overlay_width, overlay_height)
-            if not overlay_rect.collidepoint(x, y):
-                self.show_token_selector = False
-                return True
-            
             return True  # Handled click in the token selector area
             
         # Help overlay consumes clicks while visible
@@ -488,10 +601,21 @@ class OverlayManager:
         return False  # Click not handled by overlays
 
     def draw(self, current_filename=None):
-        """Draw all active overlays."""
-        self.draw_help_overlay()
-        self.draw_token_selector()
-        self.draw_notifications()
-        
-        if current_filename:
-            self.draw_filename(current_filename)
\ No newline at end of file
+        """Draw all active overlays and return the rects they cover."""
+        # Nothing to do on frames without any overlay
+        show_filename = self.show_filename and current_filename
+        if not (self.show_help or self.show_color_selector or self.show_token_selector
+                or self.notifications or show_filename):
+            return []
+            
+        rects = [
+            self.draw_help_overlay(),
+            self.draw_color_selector(),
+            self.draw_token_selector(),
+            self.draw_notifications(),
+        ]
+        
+        if show_filename:
+            rects.append(self.draw_filename(current_filename))
+            
+        return [rect for rect in rects if rect]
\ No newline at end of file
@@ -18,6 +18,11 @@ class GameWindow:
         # Set up display
         self.create_window()
         
+        # Screen areas changed since the last display update; with none
+        # marked, the whole display is presented as before
+        self._dirty_rects = []
+        self._full_redraw = False
+        
         # Set up clock
         self.clock = pygame.time.Clock()
         self.fps = 60
@@ -37,6 +42,10 @@ class GameWindow:
             MOUSEMOTION: self.handle_mousemotion
         }
         
+        # Have SDL drop high-rate input nobody here handles; window, expose
+        # and resize events still come through
+        pygame.event.set_blocked([JOYAXISMOTION, JOYBALLMOTION, JOYHATMOTION, FINGERMOTION])
+        
         # Custom event handlers for specific keys and mouse buttons
         self.key_handlers = {}
         self.mouse_handlers = {
@@ -47,11 +56,16 @@ class GameWindow:
         
     def create_window(self):
         """Create or recreate the game window with current settings."""
-        flags = pygame.DOUBLEBUF
+        # SCALED presents through SDL's GPU renderer where one is available
+        flags = pygame.DOUBLEBUF | pygame.SCALED
         if self.fullscreen:
             flags |= pygame.FULLSCREEN
         
-        self.screen = pygame.display.set_mode((self.width, self.height), flags)
+        try:
+            self.screen = pygame.display.set_mode((self.width, self.height), flags)
+        except pygame.error as e:
+            print(f"Error creating scaled window, falling back to software: {e}")
+            self.screen = pygame.display.set_mode((self.width, self.height), flags & ~pygame.SCALED)
         pygame.display.set_caption("MapMaster")
         
         # Black background
@@ -117,17 +131,58 @@ class GameWindow:
         
     def process_events(self):
         """Process all pending events."""
+        # A run of motion events only needs its last one unless we are drawing,
+        # where every position is part of the stroke
+        last_motion = None
         for event in pygame.event.get():
+            if event.type == MOUSEMOTION and not self.drawing:
+                last_motion = event
+                continue
+            if last_motion is not None:
+                self.handle_mousemotion(last_motion)
+                last_motion = None
             if event.type in self.event_handlers:
                 self.event_handlers[event.type](event)
+            elif event.type in (VIDEOEXPOSE, VIDEORESIZE):
+                self.mark_dirty()  # Present the whole window again
+        if last_motion is not None:
+            self.handle_mousemotion(last_motion)
     
     def clear_screen(self):
         """Clear the screen to black."""
         self.screen.fill((0, 0, 0))
+        self.mark_dirty()
+    
+    def mark_dirty(self, rect=None):
+        """Mark rect as changed for the next display update, or the whole screen if None."""
+        if rect is None:
+            self._full_redraw = True
+        elif rect:
+            self._dirty_rects.append(pygame.Rect(rect))
+    
+    def _coalesce_dirty_rects(self):
+        """Merge overlapping dirty rects so no area is updated twice."""
+        merged = []
+        for rect in self._dirty_rects:
+            # Absorb every rect this one touches, repeating as it grows
+            while True:
+                hits = rect.collidelistall(merged)
+                if not hits:
+                    break
+                rect = rect.unionall([merged[i] for i in hits])
+                for i in reversed(hits):
+                    del merged[i]
+            merged.append(rect)
+        return merged
     
     def update_display(self):
-        """Update the display."""
-        pygame.display.flip()
+        """Update the parts of the display marked dirty, or all of it if none were marked."""
+        if self._dirty_rects and not self._full_redraw:
+            pygame.display.update(self._coalesce_dirty_rects())
+        else:
+            pygame.display.flip()
+        self._dirty_rects.clear()
+        self._full_redraw = False
         self.clock.tick(self.fps)
     
     def quit(self):
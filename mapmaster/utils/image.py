@@ -1,7 +1,5 @@
 import os
 import pygame
-from PIL import Image
-import numpy as np
 
 def load_image(filepath):
     """Load an image from filesystem and convert to Pygame surface."""
@@ -13,22 +11,38 @@ def load_image(filepath):
         # Return a small red square as fallback
         fallback = pygame.Surface((100, 100))
         fallback.fill((255, 0, 0))
-        return fallback
+        return fallback.convert()
+
+# Image file extensions recognised in map and token directories
+SUPPORTED_FORMATS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+# Directory listings as (mtime, sorted image paths), by directory
+_DIR_CACHE = {}
 
 def get_image_files(directory):
-    """Get list of image files in directory."""
-    supported_formats = ['.jpg', '.jpeg', '.png', '.bmp', '.gif']
-    images = []
-    
+    """Get list of image files in directory, rescanning only when it has changed."""
     if not os.path.exists(directory):
         print(f"Warning: Directory {directory} does not exist.")
-        return images
+        return []
         
-    for file in os.listdir(directory):
-        if any(file.lower().endswith(fmt) for fmt in supported_formats):
-            images.append(os.path.join(directory, file))
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        mtime = None
+    cached = _DIR_CACHE.get(directory)
+    if mtime is not None and cached and cached[0] == mtime:
+        return cached[1]
+        
+    images = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(SUPPORTED_FORMATS) and entry.is_file():
+                images.append(entry.path)
     
-    return sorted(images)
+    images.sort()
+    if mtime is not None:
+        _DIR_CACHE[directory] = (mtime, images)
+    return images
 
 def scale_image_to_fit(image, width, height):
     """Scale image to fit within dimensions while maintaining aspect ratio."""
@@ -49,11 +63,52 @@ def scale_image_to_fit(image, width, height):
     scaled_image = pygame.transform.smoothscale(image, (new_width, new_height))
     return scaled_image
 
-def surface_to_bytes(surface):
-    """Convert a pygame surface to bytes for streaming."""
-    image_data = pygame.surfarray.array3d(surface)
-    # Convert from (width, height, 3) to (height, width, 3)
-    image_data = image_data.transpose([1, 0, 2])
-    # Convert to BGR (for OpenCV compatibility)
-    image_data = image_data[:, :, ::-1].copy()
-    return image_data
\ No newline at end of file
+def blit_sequence(target, blit_pairs):
+    """Blit a sequence of (surface, position) pairs in a single call."""
+    # pygame-ce's fblits skips building the list of changed rects
+    if hasattr(target, 'fblits'):
+        target.fblits(blit_pairs)
+    else:
+        target.blits(blit_pairs, doreturn=False)
+
+# Circular alpha masks: size -> (size, size) uint8 array (read-only)
+_CIRCLE_MASK_CACHE = {}
+
+def get_circle_mask(size):
+    """Get the cached alpha mask of the disc inscribed in a size x size square."""
+    mask = _CIRCLE_MASK_CACHE.get(size)
+    if mask is None:
+        disc = pygame.Surface((size, size), pygame.SRCALPHA)
+        pygame.draw.circle(disc, (255, 255, 255, 255), (size // 2, size // 2), size // 2)
+        mask = pygame.surfarray.array_alpha(disc)
+        _CIRCLE_MASK_CACHE[size] = mask
+    return mask
+
+def clip_to_circle(surface):
+    """Cut a square per-pixel alpha surface to its inscribed disc, in place."""
+    import numpy as np
+    
+    # Clip the alpha channel to the disc in a single pass
+    alpha = pygame.surfarray.pixels_alpha(surface)
+    np.minimum(alpha, get_circle_mask(surface.get_width()), out=alpha)
+    del alpha  # Release the surface lock
+
+def surface_to_bytes(surface, out=None):
+    """Convert a pygame surface to bytes for streaming, reusing out when its shape fits."""
+    import numpy as np
+    
+    # Reference the pixels in place where the depth allows it
+    if surface.get_bytesize() in (3, 4):
+        image_data = pygame.surfarray.pixels3d(surface)
+    else:
+        image_data = pygame.surfarray.array3d(surface)
+        
+    width, height = surface.get_size()
+    if out is None or out.shape != (height, width, 3) or out.dtype != np.uint8:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+        
+    # Transpose to (height, width, 3) and swap to BGR (for OpenCV compatibility)
+    # in a single pass over the pixels
+    np.copyto(out, image_data[:, :, ::-1].swapaxes(0, 1))
+    del image_data  # Release the surface lock
+    return out
@@ -1,19 +1,26 @@
 import socket
 import netifaces
 
+# LAN address found by get_local_ip, once there is one
+_LOCAL_IP = None
+
 def get_local_ip():
     """Get the local IP address of this machine on the LAN."""
+    global _LOCAL_IP
+    if _LOCAL_IP:
+        return _LOCAL_IP
+        
     try:
         # Try to get the preferred interface
-        interfaces = netifaces.interfaces()
+        interfaces = [i for i in netifaces.interfaces() if i.startswith(('en', 'eth', 'wlan'))]  # Common interface names
         for interface in interfaces:
-            if interface.startswith(('en', 'eth', 'wlan')):  # Common interface names
-                addresses = netifaces.ifaddresses(interface)
-                if netifaces.AF_INET in addresses:
-                    for link in addresses[netifaces.AF_INET]:
-                        ip = link['addr']
-                        if not ip.startswith('127.'):  # Skip localhost
-                            return ip
+            addresses = netifaces.ifaddresses(interface)
+            if netifaces.AF_INET in addresses:
+                for link in addresses[netifaces.AF_INET]:
+                    ip = link['addr']
+                    if not ip.startswith('127.'):  # Skip localhost
+                        _LOCAL_IP = ip
+                        return ip
         
         # Fallback method
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -21,18 +28,19 @@ def get_local_ip():
         s.connect(("8.8.8.8", 80))  # Google's DNS server
         ip = s.getsockname()[0]
         s.close()
+        _LOCAL_IP = ip
         return ip
     except Exception as e:
         print(f"Error getting local IP: {e}")
-        return "127.0.0.1"  # Return localhost as fallback
+        return "127.0.0.1"  # Return localhost as fallback, and try again next time
 
-def find_free_port(start_port=5000, max_attempts=100):
-    """Find a free port starting from start_port."""
-    for port in range(start_port, start_port + max_attempts):
+def find_free_port(start_port=5000):
+    """Find a free port, preferring start_port and otherwise letting the OS pick one."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        # Servers reuse ports still in TIME_WAIT, so the probe should too
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.bind(('', port))
-                return port
+            s.bind(('', start_port))
         except OSError:
-            continue
-    return start_port  # Fall back to the start port
\ No newline at end of file
+            s.bind(('', 0))
+        return s.getsockname()[1]
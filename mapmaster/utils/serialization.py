@@ -0,0 +1,24 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(obj):
+    """Convert numpy arrays and scalars for the stdlib encoder."""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj):
+    """Serialize obj to compact JSON bytes, using orjson when it is installed."""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(',', ':'), default=_default).encode('utf-8')
+
+def loads(data):
+    """Parse JSON from bytes or str."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
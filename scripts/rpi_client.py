@@ -5,6 +5,7 @@ A lightweight MJPEG stream viewer optimized for Raspberry Pi devices.
 
 Usage:
     python3 rpi_client.py http://server_ip:port/stream
+    python3 rpi_client.py --gpu http://server_ip:port/stream  # scale on the GPU
 """
 
 import pygame
@@ -12,23 +13,33 @@ import requests
 import io
 import argparse
 import re
+import queue
 import threading
 from PIL import Image
 
+try:
+    import numpy as np
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+# Accepted stream URL format
+URL_RE = re.compile(
+    r'(http://|https://)'  # protocol
+    r'(([0-9]{1,3}\.){3}[0-9]{1,3}|'  # IPv4
+    r'([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,})'  # domain name
+    r'(:[0-9]+)?'  # optional port
+    r'(/.*)?'  # optional path
+)
+
 # Function to validate the URL format
 def is_valid_url(url):
-    regex = re.compile(
-        r'^(http://|https://)'  # protocol
-        r'(([0-9]{1,3}\.){3}[0-9]{1,3}|'  # IPv4
-        r'([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,})'  # domain name
-        r'(:[0-9]+)?'  # optional port
-        r'(/.*)?$'  # optional path
-    )
-    return re.match(regex, url) is not None
+    return URL_RE.fullmatch(url) is not None
 
 # Set up argument parsing to get the IP address from the command line
 parser = argparse.ArgumentParser(description='MJPEG Stream Viewer')
 parser.add_argument('ip_address', help='Full URL of the MJPEG stream (e.g., http://192.168.1.127:5000/stream)')
+parser.add_argument('--gpu', action='store_true', help='Scale and present frames on the GPU through SDL\'s renderer')
 args = parser.parse_args()
 
 # URL of the MJPEG stream from the command-line argument
@@ -42,9 +53,23 @@ if not is_valid_url(stream_url):
 # Initialize Pygame
 pygame.init()
 
-# Set up fullscreen mode with double buffering
-screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN | pygame.DOUBLEBUF)
-pygame.display.set_caption("MJPEG Stream Viewer")
+# Optionally let the GPU scale and present frames through an SDL renderer
+renderer = None
+if args.gpu:
+    try:
+        from pygame._sdl2.video import Window, Renderer, Texture
+        window = Window("MJPEG Stream Viewer", fullscreen_desktop=True)
+        renderer = Renderer(window)
+    except Exception as e:
+        print(f"Error creating GPU renderer, drawing on the CPU: {e}")
+
+if renderer:
+    screen_size = window.size
+else:
+    # Set up fullscreen mode with double buffering
+    screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN | pygame.DOUBLEBUF)
+    pygame.display.set_caption("MJPEG Stream Viewer")
+    screen_size = screen.get_size()
 
 # Hide the mouse cursor
 pygame.mouse.set_visible(False)
@@ -52,82 +77,427 @@ pygame.mouse.set_visible(False)
 # Create a clock to control the frame rate
 clock = pygame.time.Clock()
 
-# Shared variable for the latest image surface
-latest_surface = None
-buffer = b''
+# libjpeg-turbo's SIMD decoder, when available; Pillow otherwise
+turbo = None
+if TurboJPEG:
+    try:
+        turbo = TurboJPEG()
+    except Exception as e:
+        print(f"Error loading libjpeg-turbo, falling back to Pillow: {e}")
+
+# Decoded frames go into one of three reused surfaces: the latest complete
+# frame, the one being displayed and a free one to decode into. The lock
+# only guards the index bookkeeping, never decoding or drawing. With
+# libjpeg-turbo on the CPU path each surface shows the pixels of its own
+# RGB array, which frames are decoded straight into
+frame_surfaces = [None, None, None]
+frame_arrays = [None, None, None]
+ready_idx = None  # Latest complete frame
+reading_idx = None  # Frame being displayed
+frame_gen = 0  # Counts published frames
+last_drawn_gen = 0  # frame_gen of the frame on screen
+frame_lock = threading.Lock()
+
+def acquire_back_buffer(size):
+    """Get a frame surface of the given size that nobody is displaying or about to display."""
+    with frame_lock:
+        idx = next(i for i in range(len(frame_surfaces)) if i != ready_idx and i != reading_idx)
+    surface = frame_surfaces[idx]
+    if surface is None or surface.get_size() != size:
+        if turbo and not renderer:
+            width, height = size
+            frame_arrays[idx] = np.empty((height, width, 3), dtype=np.uint8)
+            surface = pygame.image.frombuffer(frame_arrays[idx], size, 'RGB')
+        else:
+            surface = pygame.Surface(size)
+        frame_surfaces[idx] = surface
+    return idx, surface
+
+def publish_frame(idx):
+    """Make a decoded frame surface the latest frame."""
+    global ready_idx, frame_gen
+    with frame_lock:
+        ready_idx = idx
+        frame_gen += 1
+
+# TurboJPEG (num, den) decode scale for the stream's frame size, picked on the first frame
+scaling_factor = None
+scaling_source_size = None
+
+# Largest read from the stream at once
+CHUNK_SIZE = 65536
+
+# Multipart boundary parameter of the stream's Content-Type
+BOUNDARY_RE = re.compile(r'boundary=("[^"]+"|[^;\s]+)', re.IGNORECASE)
+
+# Scale ratios between which plain scaling is used instead of smoothscale
+SMOOTHSCALE_MIN_RATIO = 0.75
+SMOOTHSCALE_MAX_RATIO = 1.5
+
+def pick_scaling_factor(width, height):
+    """Pick the largest TurboJPEG scaling factor whose output still fits the screen."""
+    screen_width, screen_height = screen_size
+    best = (1, 1)
+    best_scale = 0
+    for num, den in turbo.scaling_factors:
+        # libjpeg-turbo rounds scaled dimensions up
+        scaled_width = (width * num + den - 1) // den
+        scaled_height = (height * num + den - 1) // den
+        if scaled_width <= screen_width and scaled_height <= screen_height and num / den > best_scale:
+            best = (num, den)
+            best_scale = num / den
+    return best
+
+# Reused libjpeg-turbo output array for frames that are copied to their surface
+decode_buffer = None
+
+# Whether the installed PyTurboJPEG can decode into a given array
+decode_into_buffer = True
+
+def turbo_decode(jpg_data, out):
+    """Decode JPEG data into out, a (height, width, 3) RGB array of the scaled frame size."""
+    global decode_into_buffer
+
+    if decode_into_buffer:
+        try:
+            turbo.decode(jpg_data, scaling_factor=scaling_factor, pixel_format=TJPF_RGB, dst=out)
+            return
+        except TypeError:
+            # Older PyTurboJPEG versions always allocate the output
+            decode_into_buffer = False
+    np.copyto(out, turbo.decode(jpg_data, scaling_factor=scaling_factor, pixel_format=TJPF_RGB))
+
+def decode_jpeg(jpg_data):
+    """Decode JPEG data into a free frame surface, shrunk towards the screen size where possible."""
+    global scaling_factor, scaling_source_size, decode_buffer
+
+    if turbo:
+        try:
+            # Let the IDCT do most of the downscaling for free
+            width, height = turbo.decode_header(jpg_data)[:2]
+            if (width, height) != scaling_source_size:
+                scaling_factor = pick_scaling_factor(width, height)
+                scaling_source_size = (width, height)
+            num, den = scaling_factor
+            width, height = (width * num + den - 1) // den, (height * num + den - 1) // den
+            idx, surface = acquire_back_buffer((width, height))
+            if frame_arrays[idx] is not None:
+                # The surface shows the array's pixels, no copy needed
+                turbo_decode(jpg_data, frame_arrays[idx])
+            else:
+                if decode_buffer is None or decode_buffer.shape != (height, width, 3):
+                    decode_buffer = np.empty((height, width, 3), dtype=np.uint8)
+                turbo_decode(jpg_data, decode_buffer)
+                pygame.surfarray.blit_array(surface, decode_buffer.swapaxes(0, 1))
+            publish_frame(idx)
+            return
+        except Exception as e:
+            # Leave the frames libjpeg-turbo rejects to Pillow
+            print(f"Error decoding frame with libjpeg-turbo: {e}")
+
+    # Let libjpeg decode straight to RGB, shrunk towards the screen size,
+    # and convert whatever else it returns (e.g. CMYK) once
+    image = Image.open(io.BytesIO(jpg_data))
+    image.draft('RGB', screen_size)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    size = image.size
+    data = image.tobytes()
+
+    # Create a Pygame surface from the image, without copying the pixels twice
+    idx, surface = acquire_back_buffer(size)
+    surface.blit(pygame.image.frombuffer(data, size, 'RGB'), (0, 0))
+    publish_frame(idx)
+
+class ChunkReader:
+    """Line and length based reads over received chunks, returning data as soon as it arrives."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = bytearray()
+
+    def _fill(self):
+        """Append the next chunk; False at the end of the stream."""
+        chunk = next(self.chunks, b'')
+        self.buffer.extend(chunk)
+        return bool(chunk)
+
+    def readline(self):
+        """Read up to and including the next newline."""
+        search_from = 0
+        while True:
+            end = self.buffer.find(b'\n', search_from)
+            if end != -1:
+                line = bytes(self.buffer[:end + 1])
+                del self.buffer[:end + 1]
+                return line
+            search_from = len(self.buffer)
+            if not self._fill():
+                line = bytes(self.buffer)
+                self.buffer.clear()
+                return line
+
+    def peek(self, size):
+        """Look at up to size bytes without consuming them."""
+        while len(self.buffer) < size and self._fill():
+            pass
+        return bytes(self.buffer[:size])
+
+    def read(self, size):
+        """Read size bytes, or fewer at the end of the stream."""
+        while len(self.buffer) < size and self._fill():
+            pass
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+def read_multipart(chunks, boundary):
+    """Read JPEG parts from a multipart stream, using each part's Content-Length."""
+    delimiter = b'--' + boundary
+    stream = ChunkReader(chunks)
+    while True:
+        # Skip ahead to the next part
+        line = stream.readline()
+        if not line:
+            return
+        if not line.startswith(delimiter):
+            continue
+        if line.rstrip().endswith(b'--'):
+            return  # Closing delimiter
+
+        # Part headers, up to a blank line
+        headers = {}
+        while True:
+            line = stream.readline()
+            if not line:
+                return
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = headers.get(b'content-length')
+        if length:
+            # Read exactly the JPEG, no scanning
+            jpg_data = stream.read(int(length))
+            if len(jpg_data) < int(length):
+                return
+        else:
+            # No length given: the part runs up to the next delimiter
+            lines = []
+            while True:
+                line = stream.peek(len(delimiter))
+                if not line or line == delimiter:
+                    break
+                lines.append(stream.readline())
+            jpg_data = b''.join(lines).rstrip(b'\r\n')
+
+        # Hand the JPEG to the decode thread
+        queue_frame(jpg_data)
+
+def scan_markers(chunks):
+    """Cut JPEGs out of a stream by their start and end markers."""
+    buffer = bytearray()  # Received bytes not yet cut into JPEGs
+    start_idx = -1  # Start of the JPEG being received, once found
+    search_from = 0  # Where to resume looking for the next marker
+
+    for chunk in chunks:
+        buffer.extend(chunk)
+
+        # Cut out every complete JPEG, rescanning at most one byte
+        # of earlier chunks in case a marker was split between them
+        jpg_data = None
+        while True:
+            if start_idx == -1:
+                start_idx = buffer.find(b'\xff\xd8', search_from)  # Start of JPEG
+                if start_idx == -1:
+                    # Nothing but multipart headers so far
+                    del buffer[:-1]
+                    search_from = 0
+                    break
+                search_from = start_idx + 2
+
+            end_idx = buffer.find(b'\xff\xd9', search_from)  # End of JPEG
+            if end_idx == -1:
+                search_from = max(len(buffer) - 1, search_from)
+                break
+
+            jpg_data = bytes(buffer[start_idx:end_idx + 2])
+            del buffer[:end_idx + 2]
+            start_idx = -1
+            search_from = 0
+
+        # Hand the newest JPEG to the decode thread
+        if jpg_data:
+            queue_frame(jpg_data)
 
 def fetch_stream():
-    global latest_surface, buffer
-
     try:
         with requests.get(stream_url, stream=True) as r:
-            for chunk in r.iter_content(chunk_size=1024):
-                buffer += chunk
-
-                # Look for the JPEG start and end markers
-                start_idx = buffer.find(b'\xff\xd8')  # Start of JPEG
-                end_idx = buffer.find(b'\xff\xd9')    # End of JPEG
-
-                if start_idx != -1 and end_idx != -1:
-                    jpg_data = buffer[start_idx:end_idx + 2]
-                    buffer = buffer[end_idx + 2:]
-
-                    # Convert JPEG data to a Pygame surface
-                    image = Image.open(io.BytesIO(jpg_data))
-                    mode = image.mode
-                    size = image.size
-                    data = image.tobytes()
-
-                    # Create a Pygame surface from the image
-                    latest_surface = pygame.image.fromstring(data, size, mode)
+            # Read straight from urllib3, skipping requests' per-chunk
+            # processing; chunked responses still arrive one chunk at a time
+            chunks = r.raw.stream(CHUNK_SIZE, decode_content=True)
+
+            # Frame by the multipart boundary when the server names one;
+            # JPEG markers can also occur inside the compressed data
+            match = BOUNDARY_RE.search(r.headers.get('Content-Type', ''))
+            if match:
+                read_multipart(chunks, match.group(1).strip('"').encode('latin-1'))
+            else:
+                scan_markers(chunks)
 
     except Exception as e:
         print(f"Error fetching the stream: {e}")
 
-# Start the stream fetching in a separate thread
+def queue_frame(jpg_data):
+    """Queue a received JPEG for decoding, dropping the oldest one if decoding falls behind."""
+    try:
+        frames_queue.put_nowait(jpg_data)
+    except queue.Full:
+        try:
+            frames_queue.get_nowait()
+        except queue.Empty:
+            pass
+        frames_queue.put_nowait(jpg_data)
+
+def decode_frames():
+    """Decode queued JPEGs as they arrive."""
+    while True:
+        jpg_data = frames_queue.get()
+        try:
+            decode_jpeg(jpg_data)
+        except Exception as e:
+            print(f"Error decoding frame: {e}")
+
+# Received JPEGs waiting to be decoded; libjpeg-turbo releases the GIL
+# while decoding, so receiving the next frame overlaps with it
+frames_queue = queue.Queue(maxsize=2)
+
+# Start the stream fetching and decoding in separate threads
 stream_thread = threading.Thread(target=fetch_stream, daemon=True)
 stream_thread.start()
+decode_thread = threading.Thread(target=decode_frames, daemon=True)
+decode_thread.start()
 
 # Function to display the stream
-def display_stream():
-    global latest_surface
+def letterbox_bars(screen_rect, image_rect):
+    """Get the parts of the screen left uncovered by a centered image."""
+    bars = [
+        pygame.Rect(screen_rect.left, screen_rect.top, screen_rect.width, image_rect.top - screen_rect.top),
+        pygame.Rect(screen_rect.left, image_rect.bottom, screen_rect.width, screen_rect.bottom - image_rect.bottom),
+        pygame.Rect(screen_rect.left, image_rect.top, image_rect.left - screen_rect.left, image_rect.height),
+        pygame.Rect(image_rect.right, image_rect.top, screen_rect.right - image_rect.right, image_rect.height),
+    ]
+    return [bar for bar in bars if bar.width > 0 and bar.height > 0]
+
+# Reused target for scaling frames to the screen
+scaled_buffer = None
+
+# Streaming texture the frames are uploaded to, with --gpu
+frame_texture = None
+
+# Where and how frames are drawn, for the frame and screen sizes in layout_key
+layout = None
+layout_key = None
+
+def get_layout(img_size):
+    """Get the size, position, scaling and letterbox bars for frames of the given size."""
+    global layout, layout_key
+
+    if layout_key == (img_size, screen_size):
+        return layout
+
+    # Get screen and original image dimensions
+    screen_width, screen_height = screen_size
+    img_width, img_height = img_size
+
+    # Calculate new dimensions to fill the screen while maintaining aspect ratio
+    aspect_ratio = img_width / img_height
+    screen_aspect_ratio = screen_width / screen_height
+
+    if aspect_ratio > screen_aspect_ratio:
+        new_width = screen_width
+        new_height = int(screen_width / aspect_ratio)
+    else:
+        new_height = screen_height
+        new_width = int(screen_height * aspect_ratio)
+
+    # Calculate position to center the image
+    x = (screen_width - new_width) // 2
+    y = (screen_height - new_height) // 2
+    fit_size = (new_width, new_height)
+
+    # Near 1:1 (e.g. frames already shrunk while decoding) the frame is drawn
+    # as is or with nearest-neighbour scaling; larger changes need bilinear
+    # interpolation
+    if abs(new_width - img_width) <= 1 and abs(new_height - img_height) <= 1:
+        scale = None
+        new_width, new_height = img_width, img_height
+    elif img_width * SMOOTHSCALE_MIN_RATIO <= new_width <= img_width * SMOOTHSCALE_MAX_RATIO:
+        scale = pygame.transform.scale
+    else:
+        scale = pygame.transform.smoothscale
+
+    layout = {
+        'fit_size': fit_size,
+        'new_size': (new_width, new_height),
+        'pos': (x, y),
+        'scale': scale,
+        'letterbox_rects': letterbox_bars(pygame.Rect((0, 0), screen_size), pygame.Rect(x, y, new_width, new_height)),
+    }
+    layout_key = (img_size, screen_size)
+    return layout
+
+def present_on_gpu(surface, dest_rect):
+    """Upload a frame to the GPU and draw it scaled into dest_rect."""
+    global frame_texture
+
+    if frame_texture is None or (frame_texture.width, frame_texture.height) != surface.get_size():
+        frame_texture = Texture(renderer, surface.get_size(), streaming=True)
+    frame_texture.update(surface)
+
+    renderer.draw_color = (0, 0, 0, 255)
+    renderer.clear()
+    frame_texture.draw(dstrect=dest_rect)
+    renderer.present()
 
-    if latest_surface is not None:
-        # Get screen dimensions
-        screen_width, screen_height = screen.get_size()
-
-        # Get original image dimensions
-        img_width, img_height = latest_surface.get_size()
+def display_stream():
+    global reading_idx, last_drawn_gen, scaled_buffer
 
-        # Calculate new dimensions to fill the screen while maintaining aspect ratio
-        aspect_ratio = img_width / img_height
-        screen_aspect_ratio = screen_width / screen_height
+    # Hold on to the latest frame while it is drawn; leave the screen
+    # alone if it is still showing that frame
+    with frame_lock:
+        if frame_gen == last_drawn_gen:
+            return
+        reading_idx = ready_idx
+        last_drawn_gen = frame_gen
+    latest_surface = frame_surfaces[reading_idx] if reading_idx is not None else None
 
-        if aspect_ratio > screen_aspect_ratio:
-            new_width = screen_width
-            new_height = int(screen_width / aspect_ratio)
+    if latest_surface is not None:
+        frame_layout = get_layout(latest_surface.get_size())
+        x, y = frame_layout['pos']
+
+        # The GPU scales for free
+        if renderer:
+            present_on_gpu(latest_surface, pygame.Rect(frame_layout['pos'], frame_layout['fit_size']))
+            return
+
+        # Scale into the same surface every frame
+        new_size = frame_layout['new_size']
+        if frame_layout['scale'] is None:
+            surface = latest_surface
         else:
-            new_height = screen_height
-            new_width = int(screen_height * aspect_ratio)
-
-        # Scale the image using bilinear interpolation
-        surface = pygame.transform.smoothscale(latest_surface, (new_width, new_height))
-
-        # Create a back buffer surface
-        back_buffer = pygame.Surface((screen_width, screen_height))
-
-        # Fill the back buffer with black
-        back_buffer.fill((0, 0, 0))
-
-        # Calculate position to center the image
-        x = (screen_width - new_width) // 2
-        y = (screen_height - new_height) // 2
-
-        # Blit the image to the back buffer at the calculated position
-        back_buffer.blit(surface, (x, y))
+            if (scaled_buffer is None or scaled_buffer.get_size() != new_size
+                    or scaled_buffer.get_bitsize() != latest_surface.get_bitsize()):
+                # Scaling into a surface needs the source's pixel format
+                scaled_buffer = pygame.Surface(new_size, 0, latest_surface)
+            surface = frame_layout['scale'](latest_surface, new_size, scaled_buffer)
 
-        # Blit the back buffer to the screen
-        screen.blit(back_buffer, (0, 0))
+        # Black out only the letterbox bars, then draw the image straight to the screen
+        for bar in frame_layout['letterbox_rects']:
+            screen.fill((0, 0, 0), bar)
+        screen.blit(surface, (x, y))
 
         # Update the display
         pygame.display.flip()
@@ -142,10 +512,10 @@ while running:
             if event.key == pygame.K_ESCAPE:  # Exit on ESC key
                 running = False
 
-    display_stream()  # Continuously update the stream
+    display_stream()  # Draws only when a new frame has arrived
 
-    # Control the frame rate (e.g., 30 FPS)
-    clock.tick(30)
+    # Poll often so new frames are shown soon after they are decoded
+    clock.tick(60)
 
 # Clean up
 pygame.quit()
\ No newline at end of file